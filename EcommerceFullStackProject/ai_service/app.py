@@ -1,60 +1,474 @@
+import asyncio
+import hashlib
+import itertools
 import json
 import os
+import queue
+import random
 import re
+import sqlite3
+import sys
+import threading
 import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import lru_cache
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, every process persists on its own.
+    fcntl = None
 
 import faiss
+import httpx
 import numpy as np
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import requests
 from dotenv import load_dotenv
 from bson import ObjectId
 from pymongo import MongoClient
-from sentence_transformers import SentenceTransformer
+from pymongo.errors import OperationFailure
 
+# Loaded before importing build_index so its module-level settings see .env too.
 load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
 
+from build_index import (
+    EMBED_FIELDS,
+    FILTER_FIELDS,
+    BM25Index,
+    IdMap,
+    add_text,
+    apply_changes,
+    build_text,
+    collect_changes,
+    dump_text_index,
+    embedding_spec,
+    encode_texts,
+    files_consistent,
+    format_watermark,
+    load_id_map,
+    load_model,
+    load_meta,
+    load_text_index,
+    max_watermark,
+    parse_watermark,
+    save_all,
+    search_parameters,
+    set_search_params,
+    supports_removal,
+    supports_updates,
+)
+
 INDEX_PATH = os.getenv("AI_INDEX_PATH", "data/faiss.index")
 META_PATH = os.getenv("AI_META_PATH", "data/meta.json")
+IDS_PATH = os.getenv("AI_IDS_PATH", "data/ids.npy")
+TEXT_INDEX_PATH = os.getenv("AI_TEXT_INDEX_PATH", "data/text_index.pkl")
 MODEL_NAME = os.getenv("AI_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
 MONGO_URI = os.getenv("MONGO_URI")
 MONGO_DB = os.getenv("MONGO_DB")
 AI_LLM_PROVIDER = os.getenv("AI_LLM_PROVIDER", "ollama")
 AI_OLLAMA_URL = os.getenv("AI_OLLAMA_URL", "http://127.0.0.1:11434")
 AI_OLLAMA_MODEL = os.getenv("AI_OLLAMA_MODEL", "phi3:mini")
+AI_OLLAMA_WARMUP = os.getenv("AI_OLLAMA_WARMUP", "1") == "1"
+# Seconds; the model stays loaded at least this long after a request, longer when traffic is sparse.
+AI_OLLAMA_KEEP_ALIVE = float(os.getenv("AI_OLLAMA_KEEP_ALIVE", "300"))
+AI_OLLAMA_KEEP_ALIVE_MAX = float(os.getenv("AI_OLLAMA_KEEP_ALIVE_MAX", "3600"))
 AI_CHAT_MODE = os.getenv("AI_CHAT_MODE", "llm")
 AI_OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 AI_OPENAI_MODEL = os.getenv("AI_OPENAI_MODEL", "gpt-4o-mini")
 AI_GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 AI_GEMINI_MODEL = os.getenv("AI_GEMINI_MODEL", "gemini-1.5-flash")
+AI_GEMINI_DEADLINE = float(os.getenv("AI_GEMINI_DEADLINE", "20"))
+AI_GEMINI_HEDGE_MS = float(os.getenv("AI_GEMINI_HEDGE_MS", "2500"))
+AI_GEMINI_HEDGE_PERCENTILE = float(os.getenv("AI_GEMINI_HEDGE_PERCENTILE", "95"))
 AI_DEBUG = os.getenv("AI_DEBUG", "0") == "1"
+AI_SLOW_REQUEST_MS = float(os.getenv("AI_SLOW_REQUEST_MS", "0"))
+AI_SLOW_LOG_PATH = os.getenv("AI_SLOW_LOG_PATH", "data/slow_requests.jsonl")
+AI_PROFILE_SAMPLE_RATE = float(os.getenv("AI_PROFILE_SAMPLE_RATE", "0.1"))
+AI_PROFILE_INTERVAL_MS = float(os.getenv("AI_PROFILE_INTERVAL_MS", "5"))
+AI_LLM_TIMEOUT = float(os.getenv("AI_LLM_TIMEOUT", "30"))
+AI_LLM_MAX_CONNECTIONS = int(os.getenv("AI_LLM_MAX_CONNECTIONS", "100"))
+AI_LLM_HEALTH_INTERVAL = float(os.getenv("AI_LLM_HEALTH_INTERVAL", "15"))
+AI_LLM_HEALTH_TIMEOUT = float(os.getenv("AI_LLM_HEALTH_TIMEOUT", "2"))
+AI_LLM_HEALTH_WINDOW = int(os.getenv("AI_LLM_HEALTH_WINDOW", "20"))
+AI_LLM_BREAKER_FAILURES = int(os.getenv("AI_LLM_BREAKER_FAILURES", "3"))
+AI_LLM_BREAKER_COOLDOWN = float(os.getenv("AI_LLM_BREAKER_COOLDOWN", "30"))
+AI_LLM_CACHE_SIZE = int(os.getenv("AI_LLM_CACHE_SIZE", "1024"))
+AI_LLM_CACHE_TTL = float(os.getenv("AI_LLM_CACHE_TTL", "86400"))
+AI_LLM_CACHE_PATH = os.getenv("AI_LLM_CACHE_PATH", "data/llm_cache.sqlite3")
+AI_SEMANTIC_CACHE_SIZE = int(os.getenv("AI_SEMANTIC_CACHE_SIZE", "2000"))
+AI_SEMANTIC_CACHE_MIN = float(os.getenv("AI_SEMANTIC_CACHE_MIN", "0.92"))
+AI_SEMANTIC_CACHE_TTL = float(os.getenv("AI_SEMANTIC_CACHE_TTL", "600"))
+AI_GENERATE_CONCURRENCY = int(os.getenv("AI_GENERATE_CONCURRENCY", "8"))
+AI_GENERATE_JOBS_DIR = os.getenv("AI_GENERATE_JOBS_DIR", "data/jobs")
+AI_GENERATE_JOBS_KEEP = int(os.getenv("AI_GENERATE_JOBS_KEEP", "50"))
+# Requests per minute per provider; 0 leaves the provider unthrottled.
+AI_LLM_RATE_LIMITS = {
+    provider: float(os.getenv(f"AI_{provider.upper()}_RATE_LIMIT", "0"))
+    for provider in ("openai", "gemini", "ollama")
+}
+AI_INDEX_SYNC_INTERVAL = float(os.getenv("AI_INDEX_SYNC_INTERVAL", "60"))
+AI_INDEX_DIFF_INTERVAL = float(os.getenv("AI_INDEX_DIFF_INTERVAL", "3600"))
+AI_INDEX_PERSIST = os.getenv("AI_INDEX_PERSIST", "1") == "1"
+AI_INDEX_PERSIST_INTERVAL = float(os.getenv("AI_INDEX_PERSIST_INTERVAL", "300"))
+AI_NAME_MATCHER_DEBOUNCE = float(os.getenv("AI_NAME_MATCHER_DEBOUNCE", "30"))
+AI_INDEX_MMAP = os.getenv("AI_INDEX_MMAP", "1") == "1"
+AI_INDEX_NPROBE = int(os.getenv("AI_INDEX_NPROBE", "16"))
+AI_INDEX_EF_SEARCH = int(os.getenv("AI_INDEX_EF_SEARCH", "64"))
+AI_PRODUCT_CACHE_SIZE = int(os.getenv("AI_PRODUCT_CACHE_SIZE", "5000"))
+AI_PRODUCT_CACHE_TTL = float(os.getenv("AI_PRODUCT_CACHE_TTL", "300"))
+AI_EMBED_CACHE_SIZE = int(os.getenv("AI_EMBED_CACHE_SIZE", "2048"))
+AI_SEARCH_BATCH_MAX = int(os.getenv("AI_SEARCH_BATCH_MAX", "64"))
+AI_SEARCH_COALESCE_MAX = int(os.getenv("AI_SEARCH_COALESCE_MAX", "32"))
+AI_SEARCH_COALESCE_WAIT_MS = float(os.getenv("AI_SEARCH_COALESCE_WAIT_MS", "2"))
+AI_HYBRID_FUSION = os.getenv("AI_HYBRID_FUSION", "rrf").lower()
+AI_HYBRID_RRF_K = int(os.getenv("AI_HYBRID_RRF_K", "60"))
+AI_HYBRID_KEYWORD_WEIGHT = float(os.getenv("AI_HYBRID_KEYWORD_WEIGHT", "0.3"))
+AI_INTENT_CLASSIFIER = os.getenv("AI_INTENT_CLASSIFIER", "0") == "1"
+AI_INTENT_CLASSIFIER_MIN = float(os.getenv("AI_INTENT_CLASSIFIER_MIN", "0.8"))
 
 app = FastAPI()
 
 _index = None
-_id_map = []
+_id_map = IdMap()
+_id_pos = None
+_live_count = 0
+_index_mapped = False
+
+
+class ReadWriteLock:
+    """Lets searches run concurrently while index patches run alone.
+
+    A waiting writer holds back new readers, so a steady stream of searches
+    cannot starve the sync thread. Not reentrant.
+    """
+
+    def __init__(self) -> None:
+        self.cond = threading.Condition()
+        self.readers = 0
+        self.writing = False
+        self.waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self.cond:
+            while self.writing or self.waiting_writers:
+                self.cond.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.readers -= 1
+                if not self.readers:
+                    self.cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self.cond:
+            self.waiting_writers += 1
+            while self.writing or self.readers:
+                self.cond.wait()
+            self.waiting_writers -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.writing = False
+                self.cond.notify_all()
+
+
+_index_lock = ReadWriteLock()
+_index_dirty = False
+_index_writer_lock = None
+_index_watermark = None
+_index_sync_mode = "off"
+_index_spec = "flat"
+_index_removable = True
 _model = None
 _collection = None
 
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_text(labels) -> str:
+    # Label values are route templates, stage and provider names, never user input.
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram keyed by label values."""
+
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for pos, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][pos] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.series.items()):
+                for bound, bucket in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_label_text(key + (('le', f'{bound:g}'),))} {bucket}")
+                lines.append(f"{self.name}_bucket{_label_text(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{self.name}_sum{_label_text(key)} {total:.6f}")
+                lines.append(f"{self.name}_count{_label_text(key)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str) -> None:
+        self.name = name
+        self.help = help_text
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            lines.extend(f"{self.name}{_label_text(key)} {value:g}" for key, value in sorted(self.series.items()))
+        return lines
+
+
+_request_seconds = Histogram("ai_request_duration_seconds", "Time to produce a response, per endpoint.")
+_requests_total = Counter("ai_requests_total", "Requests handled, per endpoint and status code.")
+_stage_seconds = Histogram("ai_stage_duration_seconds", "Time spent in each pipeline stage.")
+
+
+class RequestTimings:
+    """Milliseconds per stage for the current request; nested stages are counted in both."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def snapshot(self) -> dict:
+        timings = {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()}
+        timings["total"] = round((time.perf_counter() - self.started) * 1000, 2)
+        return timings
+
+
+# Set per request by the middleware; run_in_threadpool copies the context, so
+# stages that run on worker threads still land in the right request.
+_request_timings = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def _stage(name: str, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        _stage_seconds.observe(elapsed, stage=name, **labels)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.add(name, elapsed)
+
+
+def _debug_timings() -> dict:
+    timings = _request_timings.get()
+    return {"timings_ms": timings.snapshot()} if timings is not None else {}
+
+
+class StackSampler:
+    """Wall-clock stack sampler for slow-request profiles.
+
+    While at least one sampled request is in flight, a daemon thread snapshots
+    every thread's stack each ``interval_ms`` and counts the folded stacks that
+    pass through this service's code. Requests overlapping in time share
+    samples, as with any process-wide sampler.
+    """
+
+    SOURCE_FILES = ("app.py", "build_index.py")
+
+    def __init__(self, interval_ms: float) -> None:
+        self.interval = max(interval_ms, 1.0) / 1000.0
+        self.active = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.tokens = itertools.count()
+
+    def start(self) -> int:
+        with self.lock:
+            token = next(self.tokens)
+            self.active[token] = {}
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self.thread.start()
+        self.wake.set()
+        return token
+
+    def stop(self, token: int) -> dict:
+        with self.lock:
+            return self.active.pop(token, {})
+
+    def _fold(self, frame) -> str | None:
+        names = []
+        ours = False
+        while frame is not None:
+            filename = os.path.basename(frame.f_code.co_filename)
+            ours = ours or filename in self.SOURCE_FILES
+            names.append(f"{filename}:{frame.f_code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names)) if ours else None
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while True:
+            with self.lock:
+                idle = not self.active
+                if idle:
+                    self.wake.clear()
+            if idle:
+                self.wake.wait()
+                continue
+            time.sleep(self.interval)
+            stacks = [self._fold(frame) for ident, frame in sys._current_frames().items() if ident != own]
+            with self.lock:
+                for counts in self.active.values():
+                    for stack in stacks:
+                        if stack:
+                            counts[stack] = counts.get(stack, 0) + 1
+
+
+_stack_sampler = StackSampler(AI_PROFILE_INTERVAL_MS)
+_slow_log_lock = threading.Lock()
+
+
+def _log_slow_request(record: dict) -> None:
+    with _slow_log_lock:
+        os.makedirs(os.path.dirname(AI_SLOW_LOG_PATH) or ".", exist_ok=True)
+        with open(AI_SLOW_LOG_PATH, "a", encoding="utf-8") as out:
+            out.write(json.dumps(record) + "\n")
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    timings = RequestTimings()
+    token = _request_timings.set(timings)
+    sample = None
+    if AI_SLOW_REQUEST_MS > 0 and random.random() < AI_PROFILE_SAMPLE_RATE:
+        sample = _stack_sampler.start()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        _request_timings.reset(token)
+        stacks = _stack_sampler.stop(sample) if sample is not None else {}
+        # Streaming endpoints are timed to their first byte; route templates keep the label set small.
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        elapsed = time.perf_counter() - started
+        _request_seconds.observe(elapsed, endpoint=endpoint)
+        _requests_total.inc(endpoint=endpoint, method=request.method, status=status)
+        if AI_SLOW_REQUEST_MS > 0 and elapsed * 1000 >= AI_SLOW_REQUEST_MS:
+            top = sorted(stacks.items(), key=lambda item: item[1], reverse=True)[:50]
+            _log_slow_request(
+                {
+                    "at": datetime.now(timezone.utc).isoformat(),
+                    "endpoint": endpoint,
+                    "method": request.method,
+                    "status": status,
+                    "timings_ms": timings.snapshot(),
+                    "sample_interval_ms": AI_PROFILE_INTERVAL_MS if sample is not None else None,
+                    "stacks": [{"stack": stack, "samples": count} for stack, count in top],
+                }
+            )
+
 
 @app.get("/")
 def root() -> dict:
     return {"status": "ok", "message": "AI service is running.", "health": "/health"}
 
 
-class SearchRequest(BaseModel):
+class SearchFilters(BaseModel):
+    max_price: float | None = None
+    min_price: float | None = None
+    category: str | None = None
+    in_stock: bool | None = None
+
+    def has_filters(self) -> bool:
+        return any(value is not None for value in (self.max_price, self.min_price, self.category, self.in_stock))
+
+    def key(self):
+        category = self.category.strip().lower() if self.category is not None else None
+        return (self.max_price, self.min_price, category, self.in_stock)
+
+    def mongo_query(self) -> dict:
+        """The same selection as ProductAttributes.mask, as a Mongo query."""
+        query = {}
+        price = {}
+        if self.min_price is not None:
+            price["$gte"] = self.min_price
+        if self.max_price is not None:
+            price["$lte"] = self.max_price
+        if price:
+            query["price"] = price
+        if self.category is not None:
+            pattern = rf"^\s*{re.escape(self.category.strip())}\s*$"
+            query["category"] = {"$regex": pattern, "$options": "i"}
+        if self.in_stock is True:
+            query["inStock"] = {"$ne": False}
+            query["stock"] = {"$gt": 0}
+        elif self.in_stock is False:
+            query["$or"] = [{"inStock": False}, {"stock": {"$not": {"$gt": 0}}}]
+        return query
+
+
+class SearchRequest(SearchFilters):
     query: str
     top_k: int = 12
 
 
-class ChatRequest(BaseModel):
+class BatchSearchRequest(SearchFilters):
+    queries: list[str]
+    top_k: int = 12
+
+
+class ChatRequest(SearchFilters):
     question: str
     top_k: int = 6
 
 
 class GenerateRequest(BaseModel):
     action: str
+    id: str = ""
     name: str = ""
     category: str = ""
     price: str = ""
@@ -62,22 +476,525 @@ class GenerateRequest(BaseModel):
     highlights: str = ""
 
 
+class GenerateJobRequest(BaseModel):
+    products: list[GenerateRequest] = []
+    filter: dict | None = None
+    limit: int = 0
+    apply: bool = False
+
+
 @app.on_event("startup")
 def load_assets() -> None:
-    global _index, _id_map, _model, _collection
+    global _index, _index_mapped, _id_map, _live_count, _index_watermark, _index_spec, _index_removable
+    global _model, _collection
     if not os.path.exists(INDEX_PATH) or not os.path.exists(META_PATH):
         return
 
-    _index = faiss.read_index(INDEX_PATH)
-    with open(META_PATH, "r", encoding="utf-8") as handle:
-        _id_map = json.load(handle)
-
-    _model = SentenceTransformer(MODEL_NAME)
+    # Memory-mapped, read-only loads let every worker share the same page-cache
+    # pages; the index is only copied into private memory if it gets patched.
+    if AI_INDEX_MMAP:
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        _index = faiss.read_index(INDEX_PATH, flags)
+    else:
+        _index = faiss.read_index(INDEX_PATH)
+    _index_mapped = AI_INDEX_MMAP
+    set_search_params(_index, AI_INDEX_NPROBE, AI_INDEX_EF_SEARCH)
+    _index_removable = supports_removal(_index)
+    meta = load_meta(META_PATH)
+    _index_spec = meta.get("index", "flat")
+    _id_map = load_id_map(meta, IDS_PATH, mmap=AI_INDEX_MMAP)
+    _live_count = _id_map.live_count()
+    _index_watermark = parse_watermark(meta.get("watermark"))
+    if not files_consistent(meta, _index, _id_map):
+        # Full rebuilds drop meta.json before replacing anything, so a mismatch here
+        # comes from an interrupted patch save: ids only grew and every label still
+        # resolves, and the sync replays from the older watermark.
+        print(f"{INDEX_PATH}, {IDS_PATH} and {META_PATH} come from different saves; catching up from the watermark.")
+
+    _model = load_model()
+    if AI_INTENT_CLASSIFIER:
+        _intent_router.fit_centroids(lambda texts: encode_texts(_model, texts), CLASSIFIED_INTENTS)
+    if meta.get("model") and meta["model"] != embedding_spec():
+        print(f"Index was built with {meta['model']}, querying with {embedding_spec()}; rebuild to match.")
     if MONGO_URI:
         client = MongoClient(MONGO_URI)
         db_name = MONGO_DB or client.get_database().name
         if db_name:
             _collection = client[db_name]["products"]
+            if not _load_text_indexes(meta):
+                _refresh_text_indexes()
+
+    if _collection is not None and supports_updates(_index) and AI_INDEX_SYNC_INTERVAL > 0:
+        threading.Thread(target=_index_sync_loop, name="index-sync", daemon=True).start()
+        if AI_INDEX_PERSIST:
+            threading.Thread(target=_index_persist_loop, name="index-persist", daemon=True).start()
+
+
+def _ensure_id_pos() -> dict:
+    # Built on first use (sync, filters) rather than while the index loads.
+    global _id_pos
+    if _id_pos is None:
+        _id_pos = {pid: pos for pos, pid in enumerate(_id_map) if pid}
+    return _id_pos
+
+
+def _ensure_writable_index() -> None:
+    global _index, _index_mapped
+    if not _index_mapped:
+        return
+    owned = faiss.deserialize_index(faiss.serialize_index(_index))
+    set_search_params(owned, AI_INDEX_NPROBE, AI_INDEX_EF_SEARCH)
+    _index = owned
+    _index_mapped = False
+
+
+def _apply_index_changes(docs, deleted_ids) -> None:
+    global _index_watermark, _live_count, _index_dirty
+    id_pos = _ensure_id_pos()
+    ids = [str(doc["_id"]) for doc in docs]
+    _invalidate_products(ids + list(deleted_ids))
+    embeddings = encode_texts(_model, [build_text(doc) for doc in docs]) if docs else None
+    with _index_lock.write():
+        _ensure_writable_index()
+        if _attributes is not None:
+            for pid in list(deleted_ids) + ids:
+                if pid in id_pos:
+                    _attributes.clear(id_pos[pid])
+        apply_changes(_index, _id_map, id_pos, ids, embeddings, deleted_ids)
+        _set_attributes(docs, id_pos)
+        for pid in deleted_ids:
+            _keyword_index.remove(pid)
+        for pid, doc in zip(ids, docs):
+            _keyword_index.add(pid, build_text(doc))
+        _update_product_names(docs, deleted_ids)
+        _live_count = len(id_pos)
+        _index_watermark = max_watermark(docs, _index_watermark)
+        _index_dirty = True
+    _current_name_matcher()
+
+
+def _claim_index_writer() -> bool:
+    """Elect one process per index path to write it back; the lock is held until exit."""
+    global _index_writer_lock
+    if _index_writer_lock is not None or fcntl is None:
+        return True
+    handle = open(f"{INDEX_PATH}.lock", "a")
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
+    _index_writer_lock = handle
+    return True
+
+
+def _persist_index() -> bool:
+    """Write the patched index, ids and meta if they changed and this process is the writer."""
+    global _index_dirty
+    if not AI_INDEX_PERSIST or not _index_dirty or _index is None or not _claim_index_writer():
+        return False
+    # Copying under the read lock keeps searches running; only patches wait.
+    with _index_lock.read():
+        snapshot = faiss.clone_index(_index)
+        ids_snapshot = _id_map.to_array()
+        meta = {
+            "count": _live_count,
+            "watermark": format_watermark(_index_watermark),
+            "model": embedding_spec(),
+            "index": _index_spec,
+        }
+        text = dump_text_index(_keyword_index, _product_names, meta["watermark"])
+        _index_dirty = False
+    try:
+        save_all(
+            snapshot,
+            ids_snapshot,
+            meta,
+            text,
+            index_path=INDEX_PATH,
+            ids_path=IDS_PATH,
+            meta_path=META_PATH,
+            text_path=TEXT_INDEX_PATH,
+        )
+    except BaseException:
+        # Batches applied meanwhile set the flag too; either way the snapshot was not saved.
+        _index_dirty = True
+        raise
+    return True
+
+
+def _index_persist_loop() -> None:
+    while True:
+        time.sleep(AI_INDEX_PERSIST_INTERVAL)
+        try:
+            _persist_index()
+        except (OSError, RuntimeError) as exc:
+            print(f"Could not persist {INDEX_PATH}: {exc}")
+
+
+@app.on_event("shutdown")
+def persist_index_on_shutdown() -> None:
+    _persist_index()
+
+
+_last_id_diff = 0.0
+
+
+def _sync_index(diff_ids: bool | None = None) -> int:
+    """Apply changes since the watermark; the id diff that finds deletes runs every AI_INDEX_DIFF_INTERVAL."""
+    global _last_id_diff
+    if diff_ids is None:
+        diff_ids = time.monotonic() - _last_id_diff >= AI_INDEX_DIFF_INTERVAL
+    if diff_ids:
+        _last_id_diff = time.monotonic()
+    docs, deleted_ids, _ = collect_changes(_collection, _ensure_id_pos(), _index_watermark, diff_ids)
+    if docs or deleted_ids:
+        _apply_index_changes(docs, deleted_ids)
+    return len(docs) + len(deleted_ids)
+
+
+def _watch_index_changes() -> None:
+    global _index_watermark
+    pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+    with _collection.watch(pipeline, full_document="updateLookup", max_await_time_ms=1000) as stream:
+        # Catch up only once the stream is open so nothing written in between is lost;
+        # later deletes arrive on the stream, so this is the only id diff needed.
+        _sync_index(diff_ids=True)
+        pending = {}
+        deleted = set()
+        touched = {}
+        while True:
+            change = stream.try_next()
+            if change is not None:
+                pid = str(change["documentKey"]["_id"])
+                document = change.get("fullDocument")
+                updated_fields = (change.get("updateDescription") or {}).get("updatedFields") or {}
+                if change["operationType"] == "delete" or document is None:
+                    pending.pop(pid, None)
+                    deleted.add(pid)
+                elif change["operationType"] == "update" and not any(
+                    field.split(".")[0] in EMBED_FIELDS for field in updated_fields
+                ):
+                    # Stock and price edits only need the cached document and filter columns refreshed.
+                    touched[pid] = document
+                else:
+                    pending[pid] = document
+                    deleted.discard(pid)
+                if len(pending) < 256:
+                    continue
+            if touched:
+                _invalidate_products(list(touched))
+                with _index_lock.write():
+                    _set_attributes(touched.values(), _ensure_id_pos())
+                    # Advance the watermark so the catalog version (and LLM cache keys) move too.
+                    _index_watermark = max_watermark(touched.values(), _index_watermark)
+                touched = {}
+            if pending or deleted:
+                _apply_index_changes(list(pending.values()), sorted(deleted))
+                pending = {}
+                deleted = set()
+
+
+def _index_sync_loop() -> None:
+    global _index_sync_mode
+    try:
+        _index_sync_mode = "change-stream"
+        _watch_index_changes()
+    except OperationFailure:
+        # Standalone servers have no change streams; poll the updatedAt watermark instead.
+        pass
+    except Exception as exc:
+        print(f"Index change stream stopped ({exc!r}); polling instead.")
+
+    _index_sync_mode = "poll"
+    while True:
+        time.sleep(AI_INDEX_SYNC_INTERVAL)
+        try:
+            _sync_index()
+        except Exception as exc:
+            # One bad batch (a malformed id, a faiss error) must not end the sync thread.
+            print(f"Index sync failed: {exc!r}")
+
+
+_embed_cache = OrderedDict()
+_embed_cache_lock = threading.Lock()
+_embed_cache_stats = {"hits": 0, "misses": 0}
+
+
+def _encode_queries(texts) -> np.ndarray:
+    # The model is uncased, so case and whitespace variants share one entry.
+    keys = [" ".join(text.lower().split()) for text in texts]
+    rows = [None] * len(keys)
+    missing = {}
+    with _embed_cache_lock:
+        for pos, key in enumerate(keys):
+            cached = _embed_cache.get(key)
+            if cached is not None:
+                _embed_cache.move_to_end(key)
+                _embed_cache_stats["hits"] += 1
+                rows[pos] = cached
+            else:
+                _embed_cache_stats["misses"] += 1
+                missing.setdefault(key, []).append(pos)
+
+    if missing:
+        with _stage("encode"):
+            fresh = encode_texts(_model, list(missing))
+        for key, embedding in zip(missing, fresh):
+            for pos in missing[key]:
+                rows[pos] = embedding
+        if AI_EMBED_CACHE_SIZE > 0:
+            with _embed_cache_lock:
+                for key, embedding in zip(missing, fresh):
+                    _embed_cache[key] = embedding
+                while len(_embed_cache) > AI_EMBED_CACHE_SIZE:
+                    _embed_cache.popitem(last=False)
+    return np.vstack(rows)
+
+
+def _encode_query(text: str) -> np.ndarray:
+    return _encode_queries([text])
+
+
+class ProductAttributes:
+    """Filter columns (price, category code, in-stock flag) addressed by index label.
+
+    A filter becomes a boolean mask over labels and then a FAISS ID selector,
+    so the index only ever scores matching products. Deleted and tombstoned
+    labels are never live.
+    """
+
+    def __init__(self, size: int = 0) -> None:
+        self.price = np.full(size, np.nan, dtype="float32")
+        self.category = np.full(size, -1, dtype="int32")
+        self.in_stock = np.zeros(size, dtype=bool)
+        self.live = np.zeros(size, dtype=bool)
+        self.category_codes = {}
+
+    def _reserve(self, size: int) -> None:
+        if size <= len(self.live):
+            return
+        pad = max(size, len(self.live) * 2) - len(self.live)
+        self.price = np.concatenate([self.price, np.full(pad, np.nan, dtype="float32")])
+        self.category = np.concatenate([self.category, np.full(pad, -1, dtype="int32")])
+        self.in_stock = np.concatenate([self.in_stock, np.zeros(pad, dtype=bool)])
+        self.live = np.concatenate([self.live, np.zeros(pad, dtype=bool)])
+
+    def set(self, label: int, doc: dict) -> None:
+        self._reserve(label + 1)
+        try:
+            self.price[label] = float(doc.get("price"))
+        except (TypeError, ValueError):
+            self.price[label] = np.nan
+        category = str(doc.get("category") or "").strip().lower()
+        self.category[label] = self.category_codes.setdefault(category, len(self.category_codes)) if category else -1
+        self.in_stock[label] = bool(doc.get("inStock", True)) and int(doc.get("stock") or 0) > 0
+        self.live[label] = True
+
+    def clear(self, label: int) -> None:
+        if label < len(self.live):
+            self.live[label] = False
+
+    def mask(self, filters: SearchFilters) -> np.ndarray:
+        allowed = self.live.copy()
+        # NaN prices compare False, so unpriced products drop out of price filters.
+        if filters.min_price is not None:
+            allowed &= self.price >= filters.min_price
+        if filters.max_price is not None:
+            allowed &= self.price <= filters.max_price
+        if filters.category is not None:
+            code = self.category_codes.get(filters.category.strip().lower())
+            allowed &= self.category == (-2 if code is None else code)
+        if filters.in_stock is not None:
+            allowed &= self.in_stock == filters.in_stock
+        return allowed
+
+
+# Built by the first filtered request; until then only the index sync keeps up
+# a backlog of the documents it changed while a build is scanning.
+_attributes = None
+_attributes_backlog = None
+_attributes_lock = threading.Lock()
+
+
+def _ensure_attributes() -> ProductAttributes:
+    global _attributes, _attributes_backlog
+    if _attributes is not None:
+        return _attributes
+    with _attributes_lock:
+        if _attributes is not None:
+            return _attributes
+        id_pos = _ensure_id_pos()
+        with _index_lock.write():
+            _attributes_backlog = []
+        try:
+            docs = {}
+            if _collection is not None:
+                with _stage("mongo"):
+                    for doc in _collection.find({}, {field: 1 for field in FILTER_FIELDS}):
+                        docs[str(doc["_id"])] = doc
+            with _index_lock.write():
+                # Anything synced during the scan wins; deleted ids are no longer in id_pos.
+                docs.update((str(doc["_id"]), doc) for doc in _attributes_backlog)
+                attributes = ProductAttributes(len(_id_map))
+                for pid, doc in docs.items():
+                    label = id_pos.get(pid)
+                    if label is not None:
+                        attributes.set(label, doc)
+                _attributes = attributes
+        finally:
+            _attributes_backlog = None
+    return _attributes
+
+
+def _filter_mask(filters: SearchFilters):
+    if filters is None or not filters.has_filters():
+        return None
+    attributes = _ensure_attributes()
+    with _index_lock.read():
+        return attributes.mask(filters)
+
+
+def _allows_pid(allowed: np.ndarray):
+    id_pos = _ensure_id_pos()
+
+    def accept(pid) -> bool:
+        label = id_pos.get(pid)
+        return label is not None and label < len(allowed) and bool(allowed[label])
+
+    return accept
+
+
+def _set_attributes(docs, id_pos) -> None:
+    # Caller holds the index write lock.
+    if _attributes is None:
+        if _attributes_backlog is not None:
+            _attributes_backlog.extend(docs)
+        return
+    for doc in docs:
+        label = id_pos.get(str(doc["_id"]))
+        if label is not None:
+            _attributes.set(label, doc)
+
+
+def _search_vectors(embeddings: np.ndarray, top_k: int, allowed: np.ndarray | None = None):
+    k = top_k
+    params = None
+    if allowed is not None:
+        # Pre-filter inside the index so a selective filter still fills top_k.
+        matching = int(np.count_nonzero(allowed))
+        k = min(top_k, matching)
+        if k == 0:
+            return [[] for _ in embeddings]
+        bitmap = np.packbits(allowed, bitorder="little")
+        # The size is in bytes; labels past the mask are never members.
+        selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+        widen = max(_index.ntotal / matching, 1.0)
+        params = search_parameters(_index, selector, AI_INDEX_NPROBE, AI_INDEX_EF_SEARCH, widen)
+    elif not _index_removable:
+        # HNSW keeps superseded vectors under tombstoned labels; over-fetch to fill top_k.
+        k = min(top_k + len(_id_map) - _live_count, _index.ntotal)
+    with _stage("faiss"), _index_lock.read():
+        scores, indices = _index.search(embeddings, k, params=params)
+    labels = len(_id_map)
+    results = []
+    for row_scores, row_indices in zip(scores, indices):
+        hits = [
+            {"id": _id_map[idx], "score": float(score)}
+            for score, idx in zip(row_scores, row_indices)
+            if 0 <= idx < labels and _id_map[idx]
+        ]
+        results.append(hits[:top_k])
+    return results
+
+
+class SearchCoalescer:
+    """Groups concurrent single-query searches into one encode and index search.
+
+    The worker takes the first waiting query, then keeps collecting until
+    ``max_batch`` queries are queued, ``max_wait_ms`` has passed, or every
+    in-flight search is already in the batch (so a lone request never waits).
+    """
+
+    def __init__(self, max_batch: int, max_wait_ms: float) -> None:
+        self.max_batch = max(max_batch, 1)
+        self.max_wait = max(max_wait_ms, 0.0) / 1000.0
+        self.enabled = self.max_batch > 1
+        self.pending = queue.Queue()
+        self.worker = None
+        self.worker_lock = threading.Lock()
+        self.inflight = 0
+        self.stats = {"batches": 0, "queries": 0, "max_seen": 0}
+
+    def search(self, query: str, top_k: int):
+        """Return (embedding, hits) for one query; the embedding has shape (1, dim)."""
+        if not self.enabled:
+            embedding = _encode_query(query)
+            return embedding, _search_vectors(embedding, top_k)[0]
+        self._ensure_worker()
+        future = Future()
+        with self.worker_lock:
+            self.inflight += 1
+        try:
+            self.pending.put((query, top_k, future))
+            with _stage("coalesced_search"):
+                embedding, hits, stages = future.result()
+        finally:
+            with self.worker_lock:
+                self.inflight -= 1
+        # Encoding and search ran on the worker thread, outside this request's
+        # context, so copy the batch's stage times into the request's.
+        timings = _request_timings.get()
+        if timings is not None:
+            for name, seconds in stages.items():
+                timings.add(name, seconds)
+        return embedding, hits
+
+    def _ensure_worker(self) -> None:
+        if self.worker is not None:
+            return
+        with self.worker_lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run, name="search-coalescer", daemon=True)
+                self.worker.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                if len(batch) >= self.inflight and self.pending.empty():
+                    break
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(self.pending.get(timeout=remaining))
+                    else:
+                        batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            self._execute(batch)
+
+    def _execute(self, batch) -> None:
+        timings = RequestTimings()
+        context = _request_timings.set(timings)
+        try:
+            embeddings = _encode_queries([query for query, _, _ in batch])
+            rows = _search_vectors(embeddings, max(top_k for _, top_k, _ in batch))
+            for pos, (_, top_k, future) in enumerate(batch):
+                future.set_result((embeddings[pos:pos + 1], rows[pos][:top_k], dict(timings.stages)))
+        except Exception as exc:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+        finally:
+            _request_timings.reset(context)
+        self.stats["batches"] += 1
+        self.stats["queries"] += len(batch)
+        self.stats["max_seen"] = max(self.stats["max_seen"], len(batch))
+
+
+_search_coalescer = SearchCoalescer(AI_SEARCH_COALESCE_MAX, AI_SEARCH_COALESCE_WAIT_MS)
 
 
 @app.get("/health")
@@ -87,12 +1004,30 @@ def health() -> dict:
         llm_model = AI_OPENAI_MODEL
     elif AI_LLM_PROVIDER == "gemini":
         llm_model = AI_GEMINI_MODEL
+    monitored = _monitored_provider()
     return {
         "index_loaded": _index is not None,
-        "count": len(_id_map),
+        "index_type": _index_spec,
+        "embedding_model": embedding_spec(),
+        "count": _live_count,
+        "index_sync": _index_sync_mode,
+        "index_watermark": format_watermark(_index_watermark),
         "db_loaded": _collection is not None,
+        "product_cache": {"size": len(_product_cache), **_product_cache_stats},
+        "embedding_cache": {"size": len(_embed_cache), **_embed_cache_stats},
+        "llm_cache": {"size": len(_llm_cache.entries), "catalog_version": _catalog_version(), **_llm_cache.stats},
+        "semantic_cache": _semantic_cache.health(),
+        "keyword_index": {"docs": len(_keyword_index), "terms": len(_keyword_index.postings)},
+        "search_coalescing": {
+            "max_batch": _search_coalescer.max_batch,
+            "max_wait_ms": _search_coalescer.max_wait * 1000,
+            **_search_coalescer.stats,
+        },
         "llm_provider": AI_LLM_PROVIDER,
         "llm_model": llm_model,
+        "llm_health": _breakers[monitored].health() if monitored else None,
+        "gemini_hedging": _gemini_hedge.health() if monitored == "gemini" else None,
+        "ollama_residency": _ollama_residency.health() if monitored == "ollama" else None,
         "chat_mode": AI_CHAT_MODE,
         "openai_key_loaded": bool(AI_OPENAI_API_KEY) if AI_LLM_PROVIDER == "openai" else False,
         "gemini_key_loaded": bool(AI_GEMINI_API_KEY) if AI_LLM_PROVIDER == "gemini" else False,
@@ -100,6 +1035,29 @@ def health() -> dict:
     }
 
 
+@app.get("/metrics")
+def metrics() -> PlainTextResponse:
+    lines = _request_seconds.render() + _requests_total.render() + _stage_seconds.render()
+    caches = {
+        "embedding": _embed_cache_stats,
+        "product": _product_cache_stats,
+        "llm": _llm_cache.stats,
+        "semantic": _semantic_cache.stats,
+    }
+    for kind in ("hits", "misses"):
+        lines.append(f"# TYPE ai_cache_{kind}_total counter")
+        lines.extend(f'ai_cache_{kind}_total{{cache="{name}"}} {stats[kind]}' for name, stats in caches.items())
+    lines.append("# TYPE ai_index_vectors gauge")
+    lines.append(f"ai_index_vectors {_live_count}")
+    lines.append("# TYPE ai_index_slots gauge")
+    lines.append(f"ai_index_slots {_index.ntotal if _index is not None else 0}")
+    monitored = _monitored_provider()
+    if monitored:
+        lines.append("# TYPE ai_llm_breaker_open gauge")
+        lines.append(f'ai_llm_breaker_open{{provider="{monitored}"}} {int(not _breakers[monitored].available())}')
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
 @app.post("/ai/search")
 def search(req: SearchRequest) -> dict:
     if _index is None or _model is None:
@@ -109,158 +1067,169 @@ def search(req: SearchRequest) -> dict:
     if not query:
         return {"results": []}
 
-    top_k = min(max(req.top_k, 1), len(_id_map))
+    top_k = min(max(req.top_k, 1), _index.ntotal)
     if top_k == 0:
         return {"results": []}
 
-    embedding = _model.encode([query], normalize_embeddings=True)
-    embedding = np.asarray(embedding, dtype="float32")
-    scores, indices = _index.search(embedding, top_k)
+    allowed = _filter_mask(req)
+    if allowed is None:
+        _, hits = _search_coalescer.search(query, top_k)
+    else:
+        hits = _search_vectors(_encode_query(query), top_k, allowed)[0]
+    if AI_DEBUG:
+        return {"results": hits, **_debug_timings()}
+    return {"results": hits}
 
-    results = []
-    for score, idx in zip(scores[0], indices[0]):
-        if idx < 0:
-            continue
-        results.append({"id": _id_map[idx], "score": float(score)})
 
+@app.post("/ai/search/batch")
+def search_batch(req: BatchSearchRequest) -> dict:
+    if _index is None or _model is None:
+        raise HTTPException(status_code=503, detail="AI index not ready.")
+    if len(req.queries) > AI_SEARCH_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {AI_SEARCH_BATCH_MAX} queries per batch.")
+
+    queries = [query.strip() for query in req.queries]
+    results = [[] for _ in queries]
+    top_k = min(max(req.top_k, 1), _index.ntotal)
+    active = [pos for pos, query in enumerate(queries) if query]
+    if not active or top_k == 0:
+        return {"results": results}
+
+    # One encoder forward pass and one matrix search for the whole batch.
+    embeddings = _encode_queries([queries[pos] for pos in active])
+    for pos, hits in zip(active, _search_vectors(embeddings, top_k, _filter_mask(req))):
+        results[pos] = hits
     return {"results": results}
 
 
+PRODUCT_FIELDS = {
+    "name": 1,
+    "price": 1,
+    "category": 1,
+    "description": 1,
+    "stock": 1,
+    "inStock": 1,
+    "rating": 1,
+    "reviewCount": 1,
+    "highlights": 1,
+    "image": 1,
+    "originalPrice": 1,
+    "colors": 1,
+    "tags": 1,
+    "faqs": 1,
+    "seoTitle": 1,
+    "model": 1,
+    "sku": 1,
+}
+
+_product_cache = OrderedDict()
+_product_list_cache = {}
+_product_cache_lock = threading.Lock()
+_product_cache_stats = {"hits": 0, "misses": 0}
+
+
+def _cache_get_products(product_ids):
+    now = time.monotonic()
+    found = {}
+    missing = []
+    with _product_cache_lock:
+        for pid in product_ids:
+            entry = _product_cache.get(pid)
+            if entry is not None and entry[0] > now:
+                _product_cache.move_to_end(pid)
+                found[pid] = entry[1]
+            else:
+                missing.append(pid)
+        _product_cache_stats["hits"] += len(found)
+        _product_cache_stats["misses"] += len(missing)
+    return found, missing
+
+
+def _cache_put_products(docs) -> None:
+    if AI_PRODUCT_CACHE_SIZE <= 0:
+        return
+    expires_at = time.monotonic() + AI_PRODUCT_CACHE_TTL
+    with _product_cache_lock:
+        for doc in docs:
+            pid = str(doc["_id"])
+            _product_cache[pid] = (expires_at, doc)
+            _product_cache.move_to_end(pid)
+        while len(_product_cache) > AI_PRODUCT_CACHE_SIZE:
+            _product_cache.popitem(last=False)
+
+
+def _invalidate_products(product_ids) -> None:
+    with _product_cache_lock:
+        for pid in product_ids:
+            _product_cache.pop(pid, None)
+        # Any write can reorder name or price listings.
+        _product_list_cache.clear()
+
+
+def _cached_product_list(key, query):
+    now = time.monotonic()
+    with _product_cache_lock:
+        entry = _product_list_cache.get(key)
+    if entry is not None and entry[0] > now:
+        return _load_products(entry[1])
+    with _stage("mongo"):
+        products = list(query())
+    _cache_put_products(products)
+    with _product_cache_lock:
+        _product_list_cache[key] = (now + AI_PRODUCT_CACHE_TTL, [str(p["_id"]) for p in products])
+    return products
+
+
 def _load_products(product_ids):
     if _collection is None or not product_ids:
         return []
+    product_ids = [str(pid) for pid in product_ids]
+    by_id, missing = _cache_get_products(product_ids)
     object_ids = []
-    for pid in product_ids:
+    for pid in missing:
         try:
             object_ids.append(ObjectId(pid))
         except Exception:
             continue
-    if not object_ids:
-        return []
-    cursor = _collection.find(
-        {"_id": {"$in": object_ids}},
-        {
-            "name": 1,
-            "price": 1,
-            "category": 1,
-            "description": 1,
-            "stock": 1,
-            "inStock": 1,
-            "rating": 1,
-            "reviewCount": 1,
-            "highlights": 1,
-            "image": 1,
-            "originalPrice": 1,
-            "colors": 1,
-            "tags": 1,
-            "faqs": 1,
-            "seoTitle": 1,
-            "model": 1,
-            "sku": 1,
-        },
-    )
-    products = list(cursor)
-    by_id = {str(doc["_id"]): doc for doc in products}
-    ordered = [by_id.get(str(pid)) for pid in product_ids]
+    if object_ids:
+        with _stage("mongo"):
+            products = list(_collection.find({"_id": {"$in": object_ids}}, PRODUCT_FIELDS))
+        _cache_put_products(products)
+        by_id.update({str(doc["_id"]): doc for doc in products})
+    ordered = [by_id.get(pid) for pid in product_ids]
     return [item for item in ordered if item]
 
 
-def _load_all_products(limit: int = 100):
+def _load_all_products(limit: int = 100, filters: SearchFilters | None = None):
     if _collection is None:
         return []
-    cursor = _collection.find(
-        {},
-        {
-            "name": 1,
-            "price": 1,
-            "category": 1,
-            "image": 1,
-            "description": 1,
-            "stock": 1,
-            "inStock": 1,
-            "rating": 1,
-            "reviewCount": 1,
-            "highlights": 1,
-            "originalPrice": 1,
-            "colors": 1,
-            "tags": 1,
-            "faqs": 1,
-            "seoTitle": 1,
-            "model": 1,
-            "sku": 1,
-        },
-    ).limit(limit)
-    products = list(cursor)
+    query = filters.mongo_query() if filters is not None else {}
+    products = _cached_product_list(
+        ("all", limit, filters.key() if filters is not None else None),
+        lambda: _collection.find(query, PRODUCT_FIELDS).limit(limit),
+    )
     products.sort(key=lambda item: str(item.get("name", "")).lower())
     return products
 
 
-def _load_price_sorted_products(desc: bool = True, limit: int = 10):
+def _load_price_sorted_products(desc: bool = True, limit: int = 10, filters: SearchFilters | None = None):
     if _collection is None:
         return []
     order = -1 if desc else 1
-    cursor = _collection.find(
-        {},
-        {
-            "name": 1,
-            "price": 1,
-            "category": 1,
-            "image": 1,
-            "description": 1,
-            "stock": 1,
-            "inStock": 1,
-            "rating": 1,
-            "reviewCount": 1,
-            "highlights": 1,
-            "originalPrice": 1,
-            "colors": 1,
-            "model": 1,
-            "sku": 1,
-        },
-    ).sort("price", order).limit(limit)
-    return list(cursor)
+    query = filters.mongo_query() if filters is not None else {}
+    return _cached_product_list(
+        ("price", order, limit, filters.key() if filters is not None else None),
+        lambda: _collection.find(query, PRODUCT_FIELDS).sort("price", order).limit(limit),
+    )
 
 
-def _keyword_search_products(query: str, limit: int = 10):
-    if _collection is None or not query.strip():
-        return []
-    tokens = [t.strip() for t in query.lower().split() if len(t.strip()) >= 2][:8]
-    if not tokens:
-        return []
-    pattern = "|".join([re.escape(t) for t in tokens])
-    try:
-        regex = {"$regex": pattern, "$options": "i"}
-        cursor = _collection.find(
-            {
-                "$or": [
-                    {"name": regex},
-                    {"description": regex},
-                    {"category": regex},
-                    {"tags": regex},
-                ]
-            },
-            {
-                "name": 1,
-                "price": 1,
-                "category": 1,
-                "description": 1,
-                "stock": 1,
-                "inStock": 1,
-                "rating": 1,
-                "reviewCount": 1,
-                "highlights": 1,
-                "image": 1,
-                "originalPrice": 1,
-                "colors": 1,
-                "tags": 1,
-                "faqs": 1,
-                "model": 1,
-                "sku": 1,
-            },
-        ).limit(limit)
-        return list(cursor)
-    except Exception:
-        return []
+_keyword_index = BM25Index()
+
+
+def _keyword_search(query: str, limit: int = 10, allowed: np.ndarray | None = None):
+    accept = _allows_pid(allowed) if allowed is not None else None
+    with _stage("keyword"), _index_lock.read():
+        return _keyword_index.search(query, limit, accept)
 
 
 def _format_money(value):
@@ -277,29 +1246,30 @@ def _build_answer(question, products, scores):
             "\"headphones under $50\" or \"gift under $30\"."
         )
 
-    q_lower = question.lower()
+    intents = _route_intents(question)
     response_lines = []
-    top_score = scores[0] if scores else 0.0
+    # Products may be in RRF order, so the best weighted score is not necessarily first.
+    top_score = max(scores, default=0.0)
 
-    if q_lower.strip() in {"hi", "hello", "hey", "yo"}:
+    if "greeting" in intents:
         return (
             "Hi! I can help you find products, compare items, and suggest gifts. "
             "Try: \"gift under $50\" or \"cheaper than this\"."
         )
 
-    if q_lower.strip() in {"thanks", "thank you", "thx", "ok", "okay"}:
+    if "thanks" in intents:
         return "You're welcome. Ask me for product details, features, pricing, or comparisons."
 
-    if any(phrase in q_lower for phrase in ["what can you do", "what u can do", "what u cn do", "help", "how do you work", "what do you do"]):
+    if "help" in intents:
         return (
             "I can help you find products, compare items, suggest gifts, and recommend budget-friendly picks. "
             "Try asking: \"gift under $50\", \"cheaper than this\", or \"best for travel\"."
         )
 
-    if "laptop" in q_lower or "notebook" in q_lower or "macbook" in q_lower:
+    if "laptop" in intents:
         return "We do not have laptops in the catalog yet. Here are the closest electronics picks I can suggest."
 
-    if q_lower.strip() in {"feature", "features", "detail", "details", "spec", "specs"}:
+    if "detail_prompt" in intents:
         return "Please tell me which product you want details for (for example: \"features of smart watch\")."
 
     if top_score < 0.32:
@@ -309,7 +1279,7 @@ def _build_answer(question, products, scores):
         picks_text = ", ".join(picks)
         return f"I do not see a close match. Closest items: {picks_text}. Want a different budget or category?"
 
-    if "difference" in q_lower and len(products) >= 2:
+    if "compare" in intents and len(products) >= 2:
         first, second = products[0], products[1]
         response_lines.append(
             f"Here is a quick comparison between {first.get('name', 'Item 1')} and {second.get('name', 'Item 2')}:"
@@ -325,14 +1295,14 @@ def _build_answer(question, products, scores):
         )
         return "\n".join(response_lines)
 
-    if "cheaper" in q_lower:
+    if "cheaper" in intents:
         cheapest = min(products, key=lambda p: p.get("price") or 0)
         return (
             f"The most budget-friendly option I found is {cheapest.get('name', 'this item')} "
             f"at {_format_money(cheapest.get('price'))}."
         )
 
-    if "gift" in q_lower or "gifting" in q_lower:
+    if "gift" in intents:
         top = max(products, key=lambda p: p.get("rating") or 0)
         return (
             f"For gifting, {top.get('name', 'this item')} stands out with a rating of "
@@ -346,18 +1316,345 @@ def _build_answer(question, products, scores):
     return f"Here are good options from the catalog: {picks_text}. Want me to narrow it by budget, color, or use?"
 
 
-def _ollama_available() -> bool:
-    if AI_LLM_PROVIDER != "ollama":
-        return False
-    try:
-        resp = requests.get(f"{AI_OLLAMA_URL}/api/tags", timeout=2)
-        if not resp.ok:
+_llm_client = None
+
+
+def _get_llm_client() -> httpx.AsyncClient:
+    # One pooled client for every provider keeps TCP/TLS connections warm across requests.
+    global _llm_client
+    if _llm_client is None:
+        _llm_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(AI_LLM_TIMEOUT, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=AI_LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=AI_LLM_MAX_CONNECTIONS,
+            ),
+        )
+    return _llm_client
+
+
+@app.on_event("shutdown")
+async def close_llm_client() -> None:
+    global _llm_client
+    if _provider_monitor is not None:
+        _provider_monitor.cancel()
+    if _ollama_residency.warming is not None:
+        _ollama_residency.warming.cancel()
+    if _llm_client is not None:
+        await _llm_client.aclose()
+        _llm_client = None
+
+
+class ResponseCache:
+    """LRU of LLM answers in memory, written through to SQLite so it survives restarts.
+
+    Keys already encode provider, model, prompts and catalog version, so entries
+    are never updated in place; stale ones just age out after ``ttl`` seconds.
+    ``fetch`` and ``store`` are the event-loop entry points: SQLite reads and
+    writes run in a worker thread, and ``lock`` never covers disk I/O.
+    """
+
+    def __init__(self, path: str, size: int, ttl: float) -> None:
+        self.path = path
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+        self.db = None
+
+    def _connect(self):
+        if self.db is None and self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, answer TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self.db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        return self.db
+
+    def _remember(self, key: str, answer: str, created: float) -> None:
+        self.entries[key] = (created, answer)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def _read(self, key: str):
+        with self.db_lock:
+            try:
+                db = self._connect()
+                if db is not None:
+                    return db.execute("SELECT created, answer FROM responses WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error:
+                pass
+        return None
+
+    def _write(self, key: str, answer: str, created: float) -> None:
+        with self.db_lock:
+            try:
+                db = self._connect()
+                if db is not None:
+                    db.execute(
+                        "INSERT OR REPLACE INTO responses (key, answer, created) VALUES (?, ?, ?)",
+                        (key, answer, created),
+                    )
+            except sqlite3.Error:
+                pass
+
+    def _lookup(self, key: str, entry):
+        now = time.time()
+        with self.lock:
+            if entry is not None and entry[0] + self.ttl > now:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[1]
+            self.stats["misses"] += 1
+            return None
+
+    def _load(self, key: str):
+        row = self._read(key)
+        if row is None:
+            return None
+        with self.lock:
+            self._remember(key, row[1], row[0])
+        return (row[0], row[1])
+
+    def get(self, key: str):
+        if self.size <= 0:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            entry = self._load(key)
+        return self._lookup(key, entry)
+
+    def put(self, key: str, answer: str) -> None:
+        if self.size <= 0 or not answer:
+            return
+        created = time.time()
+        with self.lock:
+            self._remember(key, answer, created)
+        self._write(key, answer, created)
+
+    async def fetch(self, key: str):
+        if self.size <= 0:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            entry = await asyncio.to_thread(self._load, key)
+        return self._lookup(key, entry)
+
+    async def store(self, key: str, answer: str) -> None:
+        if self.size <= 0 or not answer:
+            return
+        created = time.time()
+        with self.lock:
+            self._remember(key, answer, created)
+        await asyncio.to_thread(self._write, key, answer, created)
+
+
+_llm_cache = ResponseCache(AI_LLM_CACHE_PATH, AI_LLM_CACHE_SIZE, AI_LLM_CACHE_TTL)
+
+
+def _catalog_version() -> str:
+    return f"{format_watermark(_index_watermark)}:{_live_count}"
+
+
+def _llm_cache_key(provider: str, prompt: str, system: str | None, versioned: bool) -> str:
+    parts = [provider, _get_active_llm_model(provider), system or "", prompt, _catalog_version() if versioned else ""]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class RateLimiter:
+    """Spaces calls to at most ``per_minute`` per minute on the event loop; 0 means unlimited."""
+
+    def __init__(self, per_minute: float) -> None:
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self.next_slot = 0.0
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+_rate_limiters = {provider: RateLimiter(limit) for provider, limit in AI_LLM_RATE_LIMITS.items()}
+
+
+class CircuitBreaker:
+    """Availability of one LLM provider, fed by request outcomes and background probes.
+
+    Closed passes calls through. After ``failures`` consecutive errors (or one
+    failed probe) it opens and calls are refused until ``cooldown`` seconds have
+    passed; it then half-opens and lets a single trial call decide whether to
+    close again or reopen. Only the event loop changes it (calls, probes); sync
+    handlers on the threadpool just read it through ``available`` and ``health``,
+    so there is no lock.
+    """
+
+    def __init__(self, failures: int, cooldown: float, window: int) -> None:
+        self.failures = max(failures, 1)
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.trial = False
+        self.outcomes = deque(maxlen=max(window, 1))
+        self.last_error = ""
+        self.last_probe = None
+        self.stats = {"calls": 0, "errors": 0, "rejected": 0, "opened": 0}
+
+    def current_state(self) -> str:
+        # Once the cooldown has passed an open breaker reads as half-open; acquire() commits it.
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return self.state
+
+    def available(self) -> bool:
+        return self.current_state() != "open"
+
+    def acquire(self) -> bool:
+        """Claim a call slot; in half-open state only one trial is let through."""
+        self.state = self.current_state()
+        if self.state == "open" or (self.state == "half_open" and self.trial):
+            self.stats["rejected"] += 1
             return False
-        data = resp.json()
-        models = [m.get("name") for m in data.get("models", [])]
-        return AI_OLLAMA_MODEL in models
-    except requests.RequestException:
-        return False
+        if self.state == "half_open":
+            self.trial = True
+        self.stats["calls"] += 1
+        return True
+
+    def release(self) -> None:
+        # The call was abandoned (cancelled, client went away) before it told us anything.
+        self.trial = False
+
+    def _open(self) -> None:
+        if self.state != "open":
+            self.stats["opened"] += 1
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.trial = False
+
+    def record(self, ok: bool, error: str = "") -> None:
+        self.outcomes.append(ok)
+        if ok:
+            self.state = "closed"
+            self.consecutive = 0
+            self.trial = False
+            return
+        self.stats["errors"] += 1
+        self.consecutive += 1
+        self.last_error = error
+        if self.state == "half_open" or self.consecutive >= self.failures:
+            self._open()
+
+    def record_probe(self, ok: bool, error: str = "") -> None:
+        self.last_probe = {"ok": ok, "at": time.time(), "error": error}
+        if ok:
+            if self.state != "closed":
+                self.state = "closed"
+                self.consecutive = 0
+                self.trial = False
+        else:
+            self.last_error = error
+            self._open()
+
+    def health(self) -> dict:
+        errors = self.outcomes.count(False)
+        return {
+            "state": self.current_state(),
+            "available": self.available(),
+            "error_rate": round(errors / len(self.outcomes), 3) if self.outcomes else 0.0,
+            "consecutive_errors": self.consecutive,
+            "last_error": self.last_error,
+            "last_probe": self.last_probe,
+            **self.stats,
+        }
+
+
+_breakers = {
+    provider: CircuitBreaker(AI_LLM_BREAKER_FAILURES, AI_LLM_BREAKER_COOLDOWN, AI_LLM_HEALTH_WINDOW)
+    for provider in ("openai", "gemini", "ollama")
+}
+_provider_monitor = None
+
+
+def _monitored_provider() -> str | None:
+    if _openai_available():
+        return "openai"
+    if _gemini_available():
+        return "gemini"
+    if AI_LLM_PROVIDER == "ollama":
+        return "ollama"
+    return None
+
+
+def _configured_llm() -> str:
+    # Reads only breaker state, so neither cached nor fresh answers wait on a health check.
+    provider = _monitored_provider()
+    if provider is None or not _breakers[provider].available():
+        return "none"
+    return provider
+
+
+async def _probe_provider(provider: str) -> None:
+    client = _get_llm_client()
+    try:
+        if provider == "ollama":
+            resp = await client.get(f"{AI_OLLAMA_URL}/api/tags", timeout=AI_LLM_HEALTH_TIMEOUT)
+            resp.raise_for_status()
+            models = [m.get("name") for m in resp.json().get("models", [])]
+            if AI_OLLAMA_MODEL not in models:
+                raise ValueError(f"{AI_OLLAMA_MODEL} is not pulled")
+        elif provider == "openai":
+            resp = await client.get(
+                "https://api.openai.com/v1/models",
+                headers={"Authorization": f"Bearer {AI_OPENAI_API_KEY}"},
+                timeout=AI_LLM_HEALTH_TIMEOUT,
+            )
+            resp.raise_for_status()
+        else:
+            resp = await client.get(
+                f"https://generativelanguage.googleapis.com/v1beta/models?key={AI_GEMINI_API_KEY}",
+                timeout=AI_LLM_HEALTH_TIMEOUT,
+            )
+            resp.raise_for_status()
+    except (httpx.HTTPError, ValueError) as exc:
+        _breakers[provider].record_probe(False, str(exc) or type(exc).__name__)
+        return
+    _breakers[provider].record_probe(True)
+
+
+async def _provider_monitor_loop(provider: str) -> None:
+    while True:
+        await asyncio.sleep(AI_LLM_HEALTH_INTERVAL)
+        await _probe_provider(provider)
+        if provider == "ollama" and _breakers[provider].state == "closed":
+            await _ollama_residency.maintain()
+
+
+@app.on_event("startup")
+async def start_provider_monitor() -> None:
+    global _provider_monitor
+    provider = _monitored_provider()
+    if provider is None:
+        return
+    # Probe once before serving so a down Ollama is known before the first chat.
+    await _probe_provider(provider)
+    if provider == "ollama" and AI_OLLAMA_WARMUP and _breakers[provider].state == "closed":
+        # Loading the model can take many seconds, so serve (from fallbacks) meanwhile.
+        _ollama_residency.warming = asyncio.create_task(_ollama_residency.warm())
+    if AI_LLM_HEALTH_INTERVAL > 0:
+        _provider_monitor = asyncio.create_task(_provider_monitor_loop(provider))
 
 
 def _openai_available() -> bool:
@@ -368,32 +1665,131 @@ def _gemini_available() -> bool:
     return AI_LLM_PROVIDER == "gemini" and bool(AI_GEMINI_API_KEY)
 
 
-def _call_ollama(prompt: str, system: str | None = None) -> str:
+class OllamaResidency:
+    """Keeps the Ollama model loaded while there is traffic and reports cold vs warm latency.
+
+    The keep-alive sent with each request is twice the longest recent gap
+    between requests, clamped to [AI_OLLAMA_KEEP_ALIVE, AI_OLLAMA_KEEP_ALIVE_MAX],
+    so a steady trickle of chats never finds the model unloaded. Ollama reports
+    ``load_duration`` per response; anything over a quarter second was a cold load.
+    """
+
+    COLD_LOAD_S = 0.25
+
+    def __init__(self, window: int = 50) -> None:
+        self.arrivals = deque(maxlen=window)
+        self.latencies = {"cold": deque(maxlen=200), "warm": deque(maxlen=200)}
+        self.resident = None
+        self.warming = None
+        self.stats = {"warmups": 0, "rewarms": 0, "cold": 0, "warm": 0}
+
+    def keep_alive(self) -> str:
+        gaps = np.diff(self.arrivals) if len(self.arrivals) > 1 else [0.0]
+        seconds = min(max(AI_OLLAMA_KEEP_ALIVE, 2 * float(np.max(gaps))), AI_OLLAMA_KEEP_ALIVE_MAX)
+        return f"{int(seconds)}s"
+
+    def arrived(self) -> None:
+        self.arrivals.append(time.monotonic())
+
+    def observe(self, data: dict) -> None:
+        # Durations are reported in nanoseconds on the final (done) response.
+        if "total_duration" not in data:
+            return
+        kind = "cold" if data.get("load_duration", 0) / 1e9 > self.COLD_LOAD_S else "warm"
+        self.stats[kind] += 1
+        self.latencies[kind].append(data["total_duration"] / 1e6)
+        self.resident = True
+
+    async def warm(self) -> None:
+        try:
+            resp = await _get_llm_client().post(
+                f"{AI_OLLAMA_URL}/api/generate",
+                json={"model": AI_OLLAMA_MODEL, "prompt": "", "stream": False, "keep_alive": self.keep_alive()},
+            )
+            resp.raise_for_status()
+        except httpx.HTTPError as exc:
+            _breakers["ollama"].record(False, str(exc) or type(exc).__name__)
+            return
+        self.stats["warmups"] += 1
+        self.observe(resp.json())
+
+    async def maintain(self) -> None:
+        """Reload the model if Ollama evicted it while requests are still arriving."""
+        try:
+            resp = await _get_llm_client().get(f"{AI_OLLAMA_URL}/api/ps", timeout=AI_LLM_HEALTH_TIMEOUT)
+            resp.raise_for_status()
+            loaded = {m.get("name") for m in resp.json().get("models", [])}
+        except (httpx.HTTPError, ValueError):
+            return
+        self.resident = AI_OLLAMA_MODEL in loaded
+        recent = self.arrivals and time.monotonic() - self.arrivals[-1] < AI_OLLAMA_KEEP_ALIVE
+        if not self.resident and recent and (self.warming is None or self.warming.done()):
+            self.stats["rewarms"] += 1
+            self.warming = asyncio.create_task(self.warm())
+
+    def health(self) -> dict:
+        latency = {
+            kind: {
+                "p50_ms": round(float(np.percentile(values, 50)), 1),
+                "p95_ms": round(float(np.percentile(values, 95)), 1),
+            }
+            for kind, values in self.latencies.items()
+            if values
+        }
+        return {"resident": self.resident, "keep_alive": self.keep_alive(), "latency": latency, **self.stats}
+
+
+_ollama_residency = OllamaResidency()
+
+
+def _ollama_payload(prompt: str, system: str | None, stream: bool) -> dict:
     system_message = system or (
         "You are a helpful ecommerce shopping assistant. "
         "Answer only using the provided product list. "
         "If there is no good match, say so and suggest closest items."
     )
-    payload = {
+    return {
         "model": AI_OLLAMA_MODEL,
         "system": system_message,
         "prompt": prompt,
-        "stream": False,
+        "stream": stream,
         "options": {
             "temperature": 0.2,
             "num_ctx": 512,
             "num_predict": 128,
             "num_batch": 8,
         },
-        "keep_alive": "0s",
+        "keep_alive": _ollama_residency.keep_alive(),
     }
-    resp = requests.post(f"{AI_OLLAMA_URL}/api/generate", json=payload, timeout=30)
+
+
+async def _call_ollama(prompt: str, system: str | None = None) -> str:
+    _ollama_residency.arrived()
+    payload = _ollama_payload(prompt, system, stream=False)
+    resp = await _get_llm_client().post(f"{AI_OLLAMA_URL}/api/generate", json=payload)
     resp.raise_for_status()
     data = resp.json()
+    _ollama_residency.observe(data)
     return data.get("response", "").strip()
 
 
-def _call_openai(prompt: str) -> str:
+async def _stream_ollama(prompt: str, system: str | None = None):
+    _ollama_residency.arrived()
+    payload = _ollama_payload(prompt, system, stream=True)
+    async with _get_llm_client().stream("POST", f"{AI_OLLAMA_URL}/api/generate", json=payload) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            if data.get("response"):
+                yield data["response"]
+            if data.get("done"):
+                _ollama_residency.observe(data)
+                break
+
+
+def _openai_request(prompt: str, stream: bool):
     headers = {
         "Authorization": f"Bearer {AI_OPENAI_API_KEY}",
         "Content-Type": "application/json",
@@ -415,11 +1811,17 @@ def _call_openai(prompt: str) -> str:
         "temperature": 0.3,
         "max_tokens": 180,
     }
-    resp = requests.post(
+    if stream:
+        payload["stream"] = True
+    return payload, headers
+
+
+async def _call_openai(prompt: str) -> str:
+    payload, headers = _openai_request(prompt, stream=False)
+    resp = await _get_llm_client().post(
         "https://api.openai.com/v1/chat/completions",
         json=payload,
         headers=headers,
-        timeout=30,
     )
     resp.raise_for_status()
     data = resp.json()
@@ -429,8 +1831,35 @@ def _call_openai(prompt: str) -> str:
     return (choices[0].get("message", {}) or {}).get("content", "").strip()
 
 
-def _call_gemini(prompt: str, system: str | None = None) -> str:
-    payload = {
+async def _iter_sse_data(resp):
+    async for line in resp.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        if data:
+            yield json.loads(data)
+
+
+async def _stream_openai(prompt: str):
+    payload, headers = _openai_request(prompt, stream=True)
+    async with _get_llm_client().stream(
+        "POST",
+        "https://api.openai.com/v1/chat/completions",
+        json=payload,
+        headers=headers,
+    ) as resp:
+        resp.raise_for_status()
+        async for data in _iter_sse_data(resp):
+            for choice in data.get("choices") or []:
+                text = (choice.get("delta") or {}).get("content")
+                if text:
+                    yield text
+
+
+def _gemini_payload(prompt: str, system: str | None) -> dict:
+    return {
         "system_instruction": {
             "parts": [
                 {
@@ -454,40 +1883,238 @@ def _call_gemini(prompt: str, system: str | None = None) -> str:
             "maxOutputTokens": 220,
         },
     }
+
+
+def _gemini_model_candidates() -> list:
     model_candidates = []
     for model in [AI_GEMINI_MODEL, "gemini-2.5-flash", "gemini-2.0-flash"]:
         if model and model not in model_candidates:
             model_candidates.append(model)
+    return model_candidates
+
+
+def _gemini_text(data: dict) -> str:
+    candidates = data.get("candidates") or []
+    if not candidates:
+        return ""
+    parts = ((candidates[0].get("content") or {}).get("parts")) or []
+    return "\n".join([p.get("text", "") for p in parts if p.get("text")])
+
+
+class HedgeStats:
+    """Latency samples and win counts for hedged Gemini calls.
+
+    The hedge delay is the configured percentile of recent winning latencies,
+    so a second candidate only starts when the first is slower than usual.
+    """
+
+    def __init__(self, default_ms: float, percentile: float, window: int = 200) -> None:
+        self.default = default_ms / 1000
+        self.percentile = percentile
+        self.latencies = deque(maxlen=window)
+        self.stats = {"calls": 0, "hedged": 0, "deadline_exceeded": 0, "failed": 0}
+        self.wins = {}
+
+    def delay(self) -> float:
+        if len(self.latencies) < 20:
+            return self.default
+        return float(np.percentile(self.latencies, self.percentile))
+
+    def win(self, model: str, latency: float, rank: int) -> None:
+        self.latencies.append(latency)
+        self.wins[model] = self.wins.get(model, 0) + 1
+        if rank:
+            self.stats["hedged"] += 1
 
+    def health(self) -> dict:
+        return {**self.stats, "hedge_delay_ms": round(self.delay() * 1000, 1), "wins": dict(self.wins)}
+
+
+_gemini_hedge = HedgeStats(AI_GEMINI_HEDGE_MS, AI_GEMINI_HEDGE_PERCENTILE)
+
+
+async def _gemini_attempt(model: str, payload: dict, deadline: float) -> tuple[str, float]:
+    """One candidate model, retrying 429s with asyncio backoff while the deadline allows."""
+    url = (
+        "https://generativelanguage.googleapis.com/v1beta/models/"
+        f"{model}:generateContent?key={AI_GEMINI_API_KEY}"
+    )
+    started = time.monotonic()
+    for attempt in range(3):
+        remaining = deadline - time.monotonic()
+        resp = await _get_llm_client().post(url, json=payload, timeout=max(remaining, 0.1))
+        backoff = 1.2 * (attempt + 1) * random.uniform(0.8, 1.2)
+        if resp.status_code == 429 and attempt < 2 and time.monotonic() + backoff < deadline:
+            await asyncio.sleep(backoff)
+            continue
+        resp.raise_for_status()
+        return _gemini_text(resp.json()).strip(), time.monotonic() - started
+    raise httpx.HTTPError(f"Gemini {model} kept returning 429")
+
+
+async def _call_gemini(prompt: str, system: str | None = None) -> str:
+    """Race the Gemini candidates against one deadline.
+
+    The first candidate starts right away; the next one starts when the running
+    ones have all failed or none has answered within the hedge delay. The first
+    good response wins and the rest are cancelled.
+    """
+    payload = _gemini_payload(prompt, system)
+    candidates = _gemini_model_candidates()
+    deadline = time.monotonic() + AI_GEMINI_DEADLINE
+    _gemini_hedge.stats["calls"] += 1
+    running = {}
+    launched = 0
     last_error: Exception | None = None
-    for model in model_candidates:
+    try:
+        while True:
+            if launched < len(candidates):
+                task = asyncio.create_task(_gemini_attempt(candidates[launched], payload, deadline))
+                running[task] = (candidates[launched], launched)
+                launched += 1
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            wait = min(_gemini_hedge.delay(), remaining) if launched < len(candidates) else remaining
+            done, _ = await asyncio.wait(running, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                model, rank = running.pop(task)
+                try:
+                    text, latency = task.result()
+                except (httpx.HTTPError, ValueError) as exc:
+                    last_error = exc
+                    continue
+                _gemini_hedge.win(model, latency, rank)
+                return text
+            if not running and launched >= len(candidates):
+                _gemini_hedge.stats["failed"] += 1
+                if last_error:
+                    raise last_error
+                raise HTTPException(status_code=502, detail="Gemini API call failed.")
+        _gemini_hedge.stats["deadline_exceeded"] += 1
+        raise httpx.TimeoutException(f"Gemini did not answer within {AI_GEMINI_DEADLINE:g}s")
+    finally:
+        for task in running:
+            task.cancel()
+
+
+async def _stream_gemini(prompt: str, system: str | None = None):
+    payload = _gemini_payload(prompt, system)
+    last_error: Exception | None = None
+    for model in _gemini_model_candidates():
         url = (
             "https://generativelanguage.googleapis.com/v1beta/models/"
-            f"{model}:generateContent?key={AI_GEMINI_API_KEY}"
+            f"{model}:streamGenerateContent?alt=sse&key={AI_GEMINI_API_KEY}"
         )
-        for attempt in range(3):
-            resp = requests.post(url, json=payload, timeout=30)
-            if resp.status_code == 429 and attempt < 2:
-                time.sleep(1.2 * (attempt + 1))
+        async with _get_llm_client().stream("POST", url, json=payload) as resp:
+            # Fall through to the next model only while nothing has been emitted.
+            if resp.is_error:
+                await resp.aread()
+                last_error = httpx.HTTPStatusError(
+                    f"Gemini {model} returned {resp.status_code}", request=resp.request, response=resp
+                )
                 continue
-            try:
-                resp.raise_for_status()
-                data = resp.json()
-                candidates = data.get("candidates") or []
-                if not candidates:
-                    return ""
-                parts = ((candidates[0].get("content") or {}).get("parts")) or []
-                texts = [p.get("text", "") for p in parts if p.get("text")]
-                return "\n".join(texts).strip()
-            except requests.RequestException as exc:
-                last_error = exc
-                break
+            async for data in _iter_sse_data(resp):
+                text = _gemini_text(data)
+                if text:
+                    yield text
+            return
 
     if last_error:
         raise last_error
     raise HTTPException(status_code=502, detail="Gemini API call failed.")
 
 
+async def _call_llm(
+    prompt: str, system: str | None = None, versioned: bool = True, cacheable=None
+) -> tuple[str, str]:
+    """Call the configured provider; returns (answer, provider) or ("", "none").
+
+    Answers are served from the response cache when the same provider, model,
+    system prompt and prompt were seen before; ``versioned`` also ties the entry
+    to the current catalog version, for prompts built from catalog data. When
+    ``cacheable(answer, provider)`` is given, answers it rejects are not cached.
+    """
+    provider = _configured_llm()
+    if provider == "none":
+        return "", "none"
+    key = _llm_cache_key(provider, prompt, system, versioned)
+    cached = await _llm_cache.fetch(key)
+    if cached is not None:
+        return cached, provider
+    breaker = _breakers[provider]
+    if not breaker.acquire():
+        return "", "none"
+    try:
+        await _rate_limiters[provider].wait()
+        with _stage("llm", provider=provider):
+            if provider == "openai":
+                answer = await _call_openai(prompt)
+            elif provider == "gemini":
+                answer = await _call_gemini(prompt, system=system)
+            else:
+                answer = await _call_ollama(prompt, system=system)
+    except Exception as exc:
+        breaker.record(False, str(exc) or type(exc).__name__)
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+    breaker.record(True)
+    if cacheable is None or cacheable(answer, provider):
+        await _llm_cache.store(key, answer)
+    return answer, provider
+
+
+async def _replay_stream(text: str):
+    yield text
+
+
+async def _cache_stream(tokens, key: str, breaker: CircuitBreaker, provider: str, cacheable=None):
+    parts = []
+    try:
+        with _stage("llm", provider=provider):
+            async for text in tokens:
+                parts.append(text)
+                yield text
+    except Exception as exc:
+        breaker.record(False, str(exc) or type(exc).__name__)
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+    breaker.record(True)
+    answer = "".join(parts)
+    if cacheable is None or cacheable(answer, provider):
+        await _llm_cache.store(key, answer)
+
+
+async def _pick_llm_stream(prompt: str, system: str | None = None, versioned: bool = True, cacheable=None):
+    """Like _call_llm, but returns (token iterator, provider); the iterator is None when no LLM is available."""
+    provider = _configured_llm()
+    if provider == "none":
+        return None, "none"
+    key = _llm_cache_key(provider, prompt, system, versioned)
+    cached = await _llm_cache.fetch(key)
+    if cached is not None:
+        return _replay_stream(cached), provider
+    breaker = _breakers[provider]
+    if not breaker.acquire():
+        return None, "none"
+    try:
+        await _rate_limiters[provider].wait()
+    except BaseException:
+        breaker.release()
+        raise
+    if provider == "openai":
+        tokens = _stream_openai(prompt)
+    elif provider == "gemini":
+        tokens = _stream_gemini(prompt, system=system)
+    else:
+        tokens = _stream_ollama(prompt, system=system)
+    return _cache_stream(tokens, key, breaker, provider, cacheable), provider
+
+
 def _get_active_llm_model(llm_used: str) -> str:
     if llm_used == "openai":
         return AI_OPENAI_MODEL
@@ -569,69 +2196,200 @@ def _looks_generic(answer: str) -> bool:
     return any(phrase in lowered for phrase in generic_phrases)
 
 
-def _hybrid_rank_products(question: str, semantic_pairs, semantic_products):
-    by_id = {}
-    for pair in semantic_pairs:
-        by_id[str(pair["id"])] = {"score": float(pair.get("score", 0.0)), "source": "semantic"}
-
-    for product in semantic_products:
-        pid = str(product.get("_id"))
-        if pid not in by_id:
-            by_id[pid] = {"score": 0.0, "source": "semantic"}
-
-    keyword_products = _keyword_search_products(question, limit=10)
-    q_lower = question.lower()
-    for product in keyword_products:
-        pid = str(product.get("_id"))
-        name = str(product.get("name") or "").lower()
-        category = str(product.get("category") or "").lower()
-        description = str(product.get("description") or "").lower()
-        boost = 0.22
-        if name and name in q_lower:
-            boost += 0.35
-        if category and category in q_lower:
-            boost += 0.12
-        token_hits = sum(1 for t in q_lower.split() if len(t) > 2 and (t in name or t in description))
-        boost += min(token_hits * 0.03, 0.18)
-        if pid not in by_id:
-            by_id[pid] = {"score": boost, "source": "keyword"}
+def _hybrid_rank_products(question: str, semantic_pairs, limit: int = 12, allowed: np.ndarray | None = None):
+    """Fuse semantic and BM25 candidates by id, then fetch the winners from Mongo once.
+
+    Candidates are ordered by reciprocal-rank fusion, or by the weighted score
+    with ``AI_HYBRID_FUSION=weighted``. The weighted score (cosine plus the
+    max-normalized BM25 score, plus a bonus for a product named in the
+    question) is what callers get back as the product score, since the answer
+    thresholds are tuned on the cosine scale.
+    """
+    candidates = {}
+
+    def candidate(pid):
+        return candidates.setdefault(pid, {"semantic": None, "keyword": None, "rrf": 0.0})
+
+    for rank, pair in enumerate(semantic_pairs):
+        item = candidate(str(pair["id"]))
+        item["semantic"] = float(pair.get("score", 0.0))
+        item["rrf"] += 1.0 / (AI_HYBRID_RRF_K + rank + 1)
+
+    keyword_hits = _keyword_search(question, limit=10, allowed=allowed)
+    top_keyword = keyword_hits[0][1] if keyword_hits else 0.0
+    for rank, (pid, score) in enumerate(keyword_hits):
+        item = candidate(pid)
+        item["keyword"] = score
+        item["rrf"] += 1.0 / (AI_HYBRID_RRF_K + rank + 1)
+
+    matcher = _current_name_matcher()
+    named = matcher.longest_match(question) if matcher is not None else None
+    if named is not None and allowed is not None and not _allows_pid(allowed)(named):
+        named = None
+    if named is not None:
+        candidate(named)["rrf"] += 1.0 / (AI_HYBRID_RRF_K + 1)
+
+    for pid, item in candidates.items():
+        weighted = item["semantic"] or 0.0
+        if item["keyword"] is not None:
+            weighted += AI_HYBRID_KEYWORD_WEIGHT * item["keyword"] / top_keyword
+        if pid == named:
+            weighted += 0.35
+        item["weighted"] = weighted
+
+    order_key = "weighted" if AI_HYBRID_FUSION == "weighted" else "rrf"
+    ranked_ids = sorted(candidates, key=lambda pid: candidates[pid][order_key], reverse=True)
+    ranked_products = _load_products(ranked_ids[:limit])
+    score_map = {pid: item["weighted"] for pid, item in candidates.items()}
+    retrieval = {}
+    for pid, item in candidates.items():
+        if item["semantic"] is not None and item["keyword"] is not None:
+            source = "hybrid"
         else:
-            by_id[pid]["score"] += boost
-            if by_id[pid]["source"] != "semantic":
-                by_id[pid]["source"] = "hybrid"
-            else:
-                by_id[pid]["source"] = "hybrid"
-
-    ranked_ids = [pid for pid, _ in sorted(by_id.items(), key=lambda kv: kv[1]["score"], reverse=True)]
-    ranked_products = _load_products(ranked_ids[:12])
-    score_map = {pid: meta["score"] for pid, meta in by_id.items()}
-    source_map = {pid: meta["source"] for pid, meta in by_id.items()}
-    return ranked_products, score_map, source_map
-
-
-def _find_named_product_in_question(question: str):
-    products = _load_all_products(limit=300)
-    q_lower = question.lower()
-    matches = []
-    for product in products:
-        name = str(product.get("name") or "").strip()
-        if not name:
-            continue
-        if name.lower() in q_lower:
-            matches.append(product)
-    if not matches:
-        return None
-    matches.sort(key=lambda p: len(str(p.get("name") or "")), reverse=True)
-    return matches[0]
+            source = "keyword" if item["keyword"] is not None else "semantic"
+        retrieval[pid] = {"source": source, **item}
+    return ranked_products, score_map, retrieval
 
 
-def _is_product_detail_query(question: str) -> bool:
-    q = question.lower()
-    detail_words = [
-        "details", "detail", "spec", "specs", "model", "sku", "price", "stock",
-        "rating", "description", "feature", "features", "highlight", "highlights"
-    ]
-    return any(w in q for w in detail_words)
+class NameMatcher:
+    """Aho-Corasick automaton over lowercased product names.
+
+    Each state keeps the longest name ending there (following failure links),
+    so one pass over the question yields the longest named product.
+    """
+
+    def __init__(self, names) -> None:
+        self.goto = [{}]
+        self.fail = [0]
+        self.best = [(0, None)]
+        for name, pid in names:
+            pattern = str(name or "").strip().lower()
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                nxt = self.goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][char] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.best.append((0, None))
+                state = nxt
+            if self.best[state][0] == 0:
+                self.best[state] = (len(pattern), pid)
+
+        # Root children keep fail=0; deeper states are linked breadth-first.
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(char, 0)
+                if self.best[self.fail[nxt]][0] > self.best[nxt][0]:
+                    self.best[nxt] = self.best[self.fail[nxt]]
+
+    def longest_match(self, text: str):
+        state = 0
+        best = (0, None)
+        for char in text.lower():
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            if self.best[state][0] > best[0]:
+                best = self.best[state]
+        return best[1]
+
+
+_name_matcher = None
+# pid -> name, kept current by the index sync so the automaton can be rebuilt
+# without going back to Mongo.
+_product_names: dict = {}
+_name_matcher_stale = False
+_name_matcher_built = 0.0
+_name_matcher_lock = threading.Lock()
+
+
+def _update_product_names(docs, deleted_ids) -> None:
+    # Caller holds the index write lock.
+    global _name_matcher_stale
+    for pid in deleted_ids:
+        if _product_names.pop(pid, None) is not None:
+            _name_matcher_stale = True
+    for doc in docs:
+        pid, name = str(doc["_id"]), doc.get("name")
+        if _product_names.get(pid) != name:
+            _product_names[pid] = name
+            _name_matcher_stale = True
+
+
+def _current_name_matcher():
+    """Return the matcher, rebuilding it from memory at most every AI_NAME_MATCHER_DEBOUNCE seconds."""
+    global _name_matcher, _name_matcher_stale, _name_matcher_built
+    if not _name_matcher_stale or time.monotonic() - _name_matcher_built < AI_NAME_MATCHER_DEBOUNCE:
+        return _name_matcher
+    if not _name_matcher_lock.acquire(blocking=False):
+        return _name_matcher
+    try:
+        with _index_lock.read():
+            names = [(name, pid) for pid, name in _product_names.items()]
+            _name_matcher_stale = False
+        _name_matcher = NameMatcher(names)
+        _name_matcher_built = time.monotonic()
+    finally:
+        _name_matcher_lock.release()
+    return _name_matcher
+
+
+def _refresh_text_indexes() -> None:
+    # One catalog scan feeds the name matcher and the BM25 index at startup; the
+    # index sync keeps both current. Filter columns wait for the first filter.
+    global _name_matcher, _name_matcher_built, _keyword_index
+    if _collection is None:
+        return
+    names = {}
+    keyword_index = BM25Index()
+    add_text(keyword_index, names, _collection.find({}, {field: 1 for field in EMBED_FIELDS}))
+    _name_matcher = NameMatcher((name, pid) for pid, name in names.items())
+    _name_matcher_built = time.monotonic()
+    with _index_lock.write():
+        _product_names.clear()
+        _product_names.update(names)
+        _keyword_index = keyword_index
+
+
+def _load_text_indexes(meta: dict) -> bool:
+    # build_index and the index persister save BM25 and the names next to the
+    # vectors, so boot reads them back instead of scanning the catalog.
+    global _keyword_index, _product_names, _name_matcher_stale, _name_matcher_built
+    text = load_text_index(meta, TEXT_INDEX_PATH)
+    if text is None:
+        return False
+    keyword_index, names = text
+    with _index_lock.write():
+        _keyword_index = keyword_index
+        _product_names = names
+        _name_matcher_stale = True
+        _name_matcher_built = 0.0
+    threading.Thread(target=_current_name_matcher, name="name-matcher", daemon=True).start()
+    return True
+
+
+def _find_named_product_in_question(question: str, filters: SearchFilters | None = None):
+    matcher = _current_name_matcher()
+    if matcher is None:
+        return None
+    pid = matcher.longest_match(question)
+    if pid is None:
+        return None
+    allowed = _filter_mask(filters)
+    if allowed is not None and not _allows_pid(allowed)(pid):
+        return None
+    products = _load_products([pid])
+    return products[0] if products else None
 
 
 def _build_product_detail_answer(question: str, product) -> str:
@@ -672,66 +2430,107 @@ def _build_product_detail_answer(question: str, product) -> str:
     return ""
 
 
-def _wants_product_list(question: str) -> bool:
-    lowered = question.lower()
-    triggers = [
-        "product list",
-        "products list",
-        "show products",
-        "show me products",
-        "all products",
-        "list products",
-        "list with prices",
-        "with prices",
-    ]
-    return any(token in lowered for token in triggers)
-
-
-def _wants_all_products(question: str) -> bool:
-    lowered = question.lower()
-    triggers = [
-        "all products",
-        "all product",
-        "all products name",
-        "all product names",
-        "from my database",
-        "from database",
-        "complete product list",
-        "full product list",
-    ]
-    return any(token in lowered for token in triggers)
-
-
-def _wants_most_expensive(question: str) -> bool:
-    lowered = question.lower()
-    triggers = [
-        "most costly",
-        "most expensive",
-        "highest price",
-        "costliest",
-        "top expensive",
-        "highest priced",
-    ]
-    return any(token in lowered for token in triggers)
-
-
-def _wants_cheapest(question: str) -> bool:
-    lowered = question.lower()
-    triggers = [
-        "cheapest",
-        "most cheap",
-        "most cheapest",
-        "cheap product",
-        "cheap item",
-        "low price",
-        "lowest priced",
-        "lowest price",
-        "least expensive",
-        "budget product",
-    ]
-    if any(token in lowered for token in triggers):
-        return True
-    return "cheap" in lowered and ("product" in lowered or "item" in lowered)
+INTENT_PHRASES = {
+    "product_list": (
+        "product list", "products list", "show products", "show me products", "all products",
+        "list products", "list with prices", "with prices",
+    ),
+    "all_products": (
+        "all products", "all product", "all products name", "all product names", "from my database",
+        "from database", "complete product list", "full product list",
+    ),
+    "most_expensive": (
+        "most costly", "most expensive", "highest price", "costliest", "top expensive", "highest priced",
+    ),
+    "cheapest": (
+        "cheapest", "most cheap", "most cheapest", "cheap product", "cheap item", "low price",
+        "lowest priced", "lowest price", "least expensive", "budget product",
+    ),
+    "product_detail": (
+        "details", "detail", "spec", "specs", "model", "sku", "price", "stock",
+        "rating", "description", "feature", "features", "highlight", "highlights",
+    ),
+    "help": ("what can you do", "what u can do", "what u cn do", "help", "how do you work", "what do you do"),
+    "laptop": ("laptop", "notebook", "macbook"),
+    "compare": ("difference",),
+    "cheaper": ("cheaper",),
+    "gift": ("gift", "gifting"),
+    # "cheap" plus "product"/"item" anywhere also means cheapest.
+    "cheap_word": ("cheap",),
+    "product_word": ("product", "item"),
+}
+
+# Replies that only fire when the whole (trimmed) question is the phrase.
+INTENT_EXACT = {
+    **dict.fromkeys(("hi", "hello", "hey", "yo"), "greeting"),
+    **dict.fromkeys(("thanks", "thank you", "thx", "ok", "okay"), "thanks"),
+    **dict.fromkeys(("feature", "features", "detail", "details", "spec", "specs"), "detail_prompt"),
+}
+
+# Catalog-wide intents the optional embedding classifier may infer when no phrase matched.
+CLASSIFIED_INTENTS = ("all_products", "most_expensive", "cheapest")
+
+
+class IntentRouter:
+    """Maps a chat question to every intent whose trigger phrases it contains.
+
+    All phrases are compiled into one lookahead alternation, longest first, so a
+    single scan of the lowercased question finds a match at every position.
+    Each phrase also carries the intents of the phrases it contains, which keeps
+    the result identical to checking every phrase with ``in``.
+    """
+
+    def __init__(self, phrases, exact) -> None:
+        self.phrases = phrases
+        self.exact = exact
+        owners = {}
+        for intent, triggers in phrases.items():
+            for phrase in triggers:
+                owners.setdefault(phrase, set()).add(intent)
+        self.intents = {
+            phrase: frozenset().union(*(owners[other] for other in owners if other in phrase))
+            for phrase in owners
+        }
+        alternation = "|".join(re.escape(phrase) for phrase in sorted(owners, key=len, reverse=True))
+        self.pattern = re.compile(f"(?=({alternation}))")
+        self.centroid_intents = ()
+        self.centroids = None
+
+    def route(self, question: str) -> frozenset:
+        lowered = question.lower()
+        found = set()
+        for match in self.pattern.finditer(lowered):
+            found |= self.intents[match.group(1)]
+        exact = self.exact.get(lowered.strip())
+        if exact:
+            found.add(exact)
+        if "cheap_word" in found and "product_word" in found:
+            found.add("cheapest")
+        return frozenset(found)
+
+    def fit_centroids(self, encode, intents) -> None:
+        """Average the embeddings of each intent's trigger phrases into one unit centroid."""
+        rows = [encode(list(self.phrases[intent])).mean(axis=0) for intent in intents]
+        centroids = np.vstack(rows).astype("float32")
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+        self.centroid_intents = tuple(intents)
+        self.centroids = centroids
+
+    def classify(self, embedding: np.ndarray, threshold: float):
+        if self.centroids is None:
+            return None
+        scores = self.centroids @ embedding.reshape(-1)
+        best = int(np.argmax(scores))
+        return self.centroid_intents[best] if scores[best] >= threshold else None
+
+
+_intent_router = IntentRouter(INTENT_PHRASES, INTENT_EXACT)
+
+
+@lru_cache(maxsize=1024)
+def _route_intents(question: str) -> frozenset:
+    # One chat request consults the intents from several places; route it once.
+    return _intent_router.route(question)
 
 
 def _build_product_list_answer(products) -> str:
@@ -838,8 +2637,8 @@ def _build_seo_title(name: str, category: str) -> str:
     return f"Buy {name} Online | {category} at E-Shop"
 
 
-@app.post("/ai/generate")
-def generate(req: GenerateRequest) -> dict:
+async def _generate_content(req: GenerateRequest) -> tuple[dict, str]:
+    """Return (content, source) where source is "llm" or "template"."""
     name = req.name.strip() or "This product"
     category = _guess_category(name, req.category.strip())
     description = (
@@ -853,7 +2652,7 @@ def generate(req: GenerateRequest) -> dict:
     faqs = _build_faqs(name)
     colors = _detect_colors(name)
 
-    if _ollama_available() or _openai_available() or _gemini_available():
+    if _configured_llm() != "none":
         prompt = (
             "Generate product content for this item. Return JSON only with keys: "
             "description (string), highlights (array), seoTitle (string), tags (array), "
@@ -862,12 +2661,7 @@ def generate(req: GenerateRequest) -> dict:
             f"Description: {req.description}\nHighlights: {req.highlights}\n"
         )
         try:
-            if _openai_available():
-                raw = _call_openai(prompt)
-            elif _gemini_available():
-                raw = _call_gemini(prompt)
-            else:
-                raw = _call_ollama(prompt)
+            raw, _ = await _call_llm(prompt, versioned=False, cacheable=_parses_as_json)
             data = json.loads(raw)
             return {
                 "description": data.get("description", description),
@@ -877,7 +2671,7 @@ def generate(req: GenerateRequest) -> dict:
                 "faqs": data.get("faqs", faqs),
                 "colors": data.get("colors", colors),
                 "category": data.get("category", category),
-            }
+            }, "llm"
         except Exception:
             pass
 
@@ -889,7 +2683,195 @@ def generate(req: GenerateRequest) -> dict:
         "faqs": faqs,
         "colors": colors,
         "category": category,
-    }
+    }, "template"
+
+
+@app.post("/ai/generate")
+async def generate(req: GenerateRequest) -> dict:
+    content, _ = await _generate_content(req)
+    return content
+
+
+# Generated fields written back to the product when a job runs with apply=true.
+GENERATED_FIELDS = ("description", "highlights", "seoTitle", "tags", "faqs")
+
+
+class GenerateJob:
+    """A bulk /ai/generate run: progress counters, listeners and a JSONL result file."""
+
+    def __init__(self, items, apply: bool) -> None:
+        self.id = uuid.uuid4().hex
+        self.items = items
+        self.apply = apply
+        self.path = os.path.join(AI_GENERATE_JOBS_DIR, f"{self.id}.jsonl")
+        self.status = "queued"
+        self.counts = {
+            "total": len(items), "done": 0, "llm": 0, "template": 0, "failed": 0, "applied": 0, "skipped": 0,
+        }
+        self.created = time.time()
+        self.finished = None
+        self.error = ""
+        self.listeners = []
+        self.task = None
+
+    def snapshot(self) -> dict:
+        elapsed = (self.finished or time.time()) - self.created
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            **({"error": self.error} if self.error else {}),
+            **self.counts,
+            "elapsed_s": round(elapsed, 2),
+            "rate_per_min": round(self.counts["done"] / elapsed * 60, 1) if elapsed > 0 else 0.0,
+        }
+
+    def publish(self, frame: dict) -> None:
+        for listener in self.listeners:
+            listener.put_nowait(frame)
+
+
+_generate_jobs = OrderedDict()
+
+
+def _job_items_from_filter(query: dict, limit: int):
+    if _collection is None:
+        raise HTTPException(status_code=503, detail="AI service not ready.")
+    projection = {"name": 1, "category": 1, "price": 1, "description": 1, "highlights": 1}
+    items = []
+    for doc in _collection.find(query, projection).limit(max(limit, 0)):
+        highlights = doc.get("highlights") or []
+        items.append(
+            GenerateRequest(
+                action="bulk",
+                id=str(doc["_id"]),
+                name=str(doc.get("name") or ""),
+                category=str(doc.get("category") or ""),
+                price=str(doc.get("price") or ""),
+                description=str(doc.get("description") or ""),
+                highlights=", ".join(map(str, highlights)) if isinstance(highlights, list) else str(highlights),
+            )
+        )
+    return items
+
+
+def _apply_generated(product_id: str, content: dict) -> bool:
+    update = {field: content[field] for field in GENERATED_FIELDS if field in content}
+    # Bumping updatedAt lets the index sync re-embed the new description and highlights.
+    update["updatedAt"] = datetime.now(timezone.utc)
+    result = _collection.update_one({"_id": ObjectId(product_id)}, {"$set": update})
+    return result.matched_count > 0
+
+
+async def _run_generate_job(job: GenerateJob) -> None:
+    job.status = "running"
+    try:
+        await _generate_job_items(job)
+        job.status = "done"
+    except Exception as exc:
+        job.status = "failed"
+        job.error = str(exc) or type(exc).__name__
+    job.finished = time.time()
+    job.publish({"type": "final", **job.snapshot()})
+
+
+async def _generate_job_items(job: GenerateJob) -> None:
+    semaphore = asyncio.Semaphore(max(AI_GENERATE_CONCURRENCY, 1))
+    os.makedirs(AI_GENERATE_JOBS_DIR, exist_ok=True)
+    with open(job.path, "w", encoding="utf-8") as out:
+
+        async def work(item: GenerateRequest) -> None:
+            record = {"id": item.id, "name": item.name}
+            async with semaphore:
+                try:
+                    content, source = await _generate_content(item)
+                    record.update(source=source, content=content)
+                    job.counts[source] += 1
+                    if job.apply and item.id and _collection is not None:
+                        # Template fallbacks are generic filler; never overwrite curated content with them.
+                        if source != "llm":
+                            record["skipped"] = True
+                            job.counts["skipped"] += 1
+                        elif await run_in_threadpool(_apply_generated, item.id, content):
+                            job.counts["applied"] += 1
+                except Exception as exc:
+                    record["error"] = str(exc)
+                    job.counts["failed"] += 1
+            job.counts["done"] += 1
+            out.write(json.dumps(record, default=str) + "\n")
+            job.publish({"type": "progress", "id": item.id, **job.counts})
+
+        await asyncio.gather(*(work(item) for item in job.items))
+
+
+def _get_generate_job(job_id: str) -> GenerateJob:
+    job = _generate_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job.")
+    return job
+
+
+@app.post("/ai/generate/jobs")
+async def create_generate_job(req: GenerateJobRequest) -> dict:
+    items = list(req.products)
+    if req.filter is not None:
+        items.extend(await run_in_threadpool(_job_items_from_filter, req.filter, req.limit))
+    if not items:
+        raise HTTPException(status_code=400, detail="No products to generate content for.")
+
+    job = GenerateJob(items, req.apply)
+    _generate_jobs[job.id] = job
+    finished = [key for key, old in _generate_jobs.items() if old.status in ("done", "failed")]
+    for key in finished[: max(len(finished) - AI_GENERATE_JOBS_KEEP, 0)]:
+        old = _generate_jobs.pop(key)
+        try:
+            os.remove(old.path)
+        except OSError:
+            pass
+    job.task = asyncio.create_task(_run_generate_job(job))
+    return job.snapshot()
+
+
+@app.get("/ai/generate/jobs/{job_id}")
+def get_generate_job(job_id: str) -> dict:
+    return _get_generate_job(job_id).snapshot()
+
+
+@app.get("/ai/generate/jobs/{job_id}/events")
+async def stream_generate_job(job_id: str) -> StreamingResponse:
+    job = _get_generate_job(job_id)
+
+    async def frames():
+        listener = asyncio.Queue()
+        job.listeners.append(listener)
+        try:
+            yield _frame({"type": "status", **job.snapshot()})
+            if job.status in ("done", "failed"):
+                return
+            while True:
+                frame = await listener.get()
+                yield _frame(frame)
+                if frame["type"] == "final":
+                    return
+        finally:
+            job.listeners.remove(listener)
+
+    return StreamingResponse(frames(), media_type="application/x-ndjson")
+
+
+@app.get("/ai/generate/jobs/{job_id}/results")
+def get_generate_job_results(job_id: str, offset: int = 0, limit: int = 100) -> dict:
+    job = _get_generate_job(job_id)
+    results = []
+    if os.path.exists(job.path):
+        with open(job.path, encoding="utf-8") as handle:
+            for position, line in enumerate(handle):
+                if position < offset:
+                    continue
+                if len(results) >= limit:
+                    break
+                results.append(json.loads(line))
+    return {**job.snapshot(), "offset": offset, "results": results}
+
 
 def _build_general_prompt(question: str) -> str:
     return (
@@ -908,128 +2890,265 @@ def _build_general_system_prompt() -> str:
     )
 
 
-@app.post("/ai/chat")
-def chat(req: ChatRequest) -> dict:
-    question = req.question.strip()
-    if not question:
-        return {"answer": "Ask me about products or pricing.", "products": []}
+def _grounded(answer: str, llm_used: str, products) -> bool:
+    """The grounding checks an LLM answer must pass to be shown, and so to be cached."""
+    answer = answer.strip()
+    return not (
+        AI_CHAT_MODE == "catalog"
+        or not answer
+        or _looks_like_refusal(answer)
+        or ((llm_used != "openai" and llm_used != "gemini") and _looks_generic(answer))
+        or ((llm_used != "openai" and llm_used != "gemini") and not _mentions_product(answer, products))
+    )
 
-    if AI_CHAT_MODE == "general":
-        answer = ""
-        llm_used = "none"
-        llm_error = ""
-        try:
-            prompt = _build_general_prompt(question)
-            if _openai_available():
-                answer = _call_openai(prompt)
-                llm_used = "openai"
-            elif _gemini_available():
-                answer = _call_gemini(prompt, system=_build_general_system_prompt())
-                llm_used = "gemini"
-            elif _ollama_available():
-                answer = _call_ollama(prompt, system=_build_general_system_prompt())
-                llm_used = "ollama"
-        except requests.RequestException as exc:
-            llm_error = str(exc)
-            answer = ""
 
-        if not answer:
-            answer = "Assistant is unavailable."
+def _grounding_check(products):
+    return lambda answer, llm_used: _grounded(answer, llm_used, products)
 
-        response = {"answer": answer, "products": []}
-        if AI_DEBUG:
-            response["llm_used"] = llm_used
-            response["llm_error"] = llm_error
-            response["llm_model"] = _get_active_llm_model(llm_used)
-        return response
 
-    if _index is None or _model is None or _collection is None:
-        raise HTTPException(status_code=503, detail="AI service not ready.")
+def _parses_as_json(answer: str, llm_used: str) -> bool:
+    try:
+        json.loads(answer)
+    except ValueError:
+        return False
+    return True
+
+
+def _finalize_chat_answer(question: str, answer: str, llm_used: str, products, scores_for_products) -> str:
+    """Apply the grounding checks to an LLM answer and fall back to a catalog answer if they fail."""
+    if not _grounded(answer, llm_used, products):
+        # Fallback stays grounded and richer than generic "closest match" text.
+        if products:
+            return _build_product_list_answer(products[:6]) if "product_list" in _route_intents(question) else _build_answer(question, products, scores_for_products)
+        return _build_answer(question, products, scores_for_products)
+    if "product_list" in _route_intents(question) or len(answer.strip()) < 40:
+        return _build_product_list_answer(products)
+    return answer
+
+
+def _chat_debug(llm_used: str, llm_error: str, products, retrieval) -> dict:
+    shown = [str(p.get("_id")) for p in products[:8]]
+    return {
+        "llm_used": llm_used,
+        "llm_error": llm_error,
+        "llm_model": _get_active_llm_model(llm_used),
+        "retrieved_names": [p.get("name") for p in products[:8]],
+        "retrieval_sources": {pid: retrieval.get(pid, {}).get("source", "semantic") for pid in shown},
+        "retrieval_scores": {
+            pid: {key: value for key, value in retrieval.get(pid, {}).items() if key != "source"}
+            for pid in shown
+        },
+        **_debug_timings(),
+    }
+
+
+def _product_summary(p) -> dict:
+    return {
+        "id": str(p.get("_id")),
+        "name": p.get("name"),
+        "price": p.get("price"),
+        "category": p.get("category"),
+        "image": p.get("image"),
+    }
+
 
-    if _wants_all_products(question):
-        all_products = _load_all_products(limit=200)
+def _answer_from_intents(question: str, filters: SearchFilters | None = None):
+    """Answer catalog-wide and product-detail questions straight from Mongo, or return None."""
+    with _stage("intent"):
+        intents = _route_intents(question)
+    if AI_INTENT_CLASSIFIER and not intents.intersection(CLASSIFIED_INTENTS):
+        # The query embedding lands in the embedding cache, so retrieval reuses it.
+        guessed = _intent_router.classify(_encode_query(question), AI_INTENT_CLASSIFIER_MIN)
+        if guessed is not None:
+            intents = intents | {guessed}
+
+    if "all_products" in intents:
+        all_products = _load_all_products(limit=200, filters=filters)
         return {
             "answer": _build_all_products_answer(all_products),
-            "products": [
-                {
-                    "id": str(p.get("_id")),
-                    "name": p.get("name"),
-                    "price": p.get("price"),
-                    "category": p.get("category"),
-                    "image": p.get("image"),
-                }
-                for p in all_products
-            ],
+            "products": [_product_summary(p) for p in all_products],
         }
 
-    if _wants_most_expensive(question):
-        expensive = _load_price_sorted_products(desc=True, limit=6)
+    if "most_expensive" in intents:
+        expensive = _load_price_sorted_products(desc=True, limit=6, filters=filters)
         return {
             "answer": _build_price_extreme_answer(expensive, "max"),
-            "products": [
-                {
-                    "id": str(p.get("_id")),
-                    "name": p.get("name"),
-                    "price": p.get("price"),
-                    "category": p.get("category"),
-                    "image": p.get("image"),
-                }
-                for p in expensive
-            ],
+            "products": [_product_summary(p) for p in expensive],
         }
 
-    if _wants_cheapest(question):
-        cheap = _load_price_sorted_products(desc=False, limit=6)
+    if "cheapest" in intents:
+        cheap = _load_price_sorted_products(desc=False, limit=6, filters=filters)
         return {
             "answer": _build_price_extreme_answer(cheap, "min"),
-            "products": [
-                {
-                    "id": str(p.get("_id")),
-                    "name": p.get("name"),
-                    "price": p.get("price"),
-                    "category": p.get("category"),
-                    "image": p.get("image"),
-                }
-                for p in cheap
-            ],
+            "products": [_product_summary(p) for p in cheap],
         }
 
-    named_product = _find_named_product_in_question(question)
-    if named_product and _is_product_detail_query(question):
+    named_product = _find_named_product_in_question(question, filters) if "product_detail" in intents else None
+    if named_product:
         detail_answer = _build_product_detail_answer(question, named_product)
         if detail_answer:
             response = {
                 "answer": detail_answer,
-                "products": [
-                    {
-                        "id": str(named_product.get("_id")),
-                        "name": named_product.get("name"),
-                        "price": named_product.get("price"),
-                        "category": named_product.get("category"),
-                        "image": named_product.get("image"),
-                    }
-                ],
+                "products": [_product_summary(named_product)],
             }
             if AI_DEBUG:
                 response["llm_used"] = "intent-db"
                 response["llm_error"] = ""
                 response["llm_model"] = _get_active_llm_model("none")
             return response
+    return None
+
+
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+
+class SemanticCache:
+    """Recent /ai/chat responses, looked up by question-embedding similarity.
+
+    Question embeddings live in a small exact inner-product index. A hit needs
+    a cosine of at least ``threshold`` and the same signature (catalog version,
+    filters, ``top_k`` and the numbers in the question, so "under $50" never
+    answers "under $100"). The oldest entry is evicted once ``size`` is reached,
+    and entries older than ``ttl`` seconds are dropped when a lookup meets them,
+    since the catalog version stays put when the index is not synced.
+    """
+
+    def __init__(self, size: int, threshold: float, ttl: float) -> None:
+        self.size = size
+        self.threshold = threshold
+        self.ttl = ttl
+        self.index = None
+        self.entries = {}
+        self.order = deque()
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def lookup(self, embedding: np.ndarray, signature):
+        if self.size <= 0:
+            return None, 0.0
+        with self.lock:
+            if self.index is None or self.index.ntotal == 0:
+                self.stats["misses"] += 1
+                return None, 0.0
+            scores, ids = self.index.search(embedding, min(8, self.index.ntotal))
+            now = time.monotonic()
+            for score, entry_id in zip(scores[0], ids[0]):
+                if entry_id < 0 or score < self.threshold:
+                    break
+                entry = self.entries[int(entry_id)]
+                if entry[2] + self.ttl <= now:
+                    del self.entries[int(entry_id)]
+                    self.order.remove(int(entry_id))
+                    self.index.remove_ids(np.asarray([entry_id], dtype="int64"))
+                    continue
+                if entry[0] == signature:
+                    self.stats["hits"] += 1
+                    return entry[1], float(score)
+            self.stats["misses"] += 1
+            return None, float(scores[0][0])
+
+    def store(self, embedding: np.ndarray, signature, response: dict) -> None:
+        if self.size <= 0:
+            return
+        with self.lock:
+            if self.index is None:
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(embedding.shape[1]))
+            entry_id = self.next_id
+            self.next_id += 1
+            self.index.add_with_ids(embedding, np.asarray([entry_id], dtype="int64"))
+            self.entries[entry_id] = (signature, response, time.monotonic())
+            self.order.append(entry_id)
+            while len(self.order) > self.size:
+                oldest = self.order.popleft()
+                self.entries.pop(oldest, None)
+                self.index.remove_ids(np.asarray([oldest], dtype="int64"))
+
+    def health(self) -> dict:
+        total = self.stats["hits"] + self.stats["misses"]
+        return {
+            "size": len(self.entries),
+            "threshold": self.threshold,
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / total, 4) if total else 0.0,
+        }
 
-    top_k = min(max(req.top_k, 1), len(_id_map))
-    embedding = _model.encode([question], normalize_embeddings=True)
-    embedding = np.asarray(embedding, dtype="float32")
-    scores, indices = _index.search(embedding, top_k)
 
-    pairs = []
-    for score, idx in zip(scores[0], indices[0]):
-        if idx < 0:
-            continue
-        pairs.append({"id": _id_map[idx], "score": float(score)})
+_semantic_cache = SemanticCache(AI_SEMANTIC_CACHE_SIZE, AI_SEMANTIC_CACHE_MIN, AI_SEMANTIC_CACHE_TTL)
+
+
+def _semantic_signature(question: str, req: ChatRequest):
+    numbers = tuple(sorted(set(_NUMBER_RE.findall(question))))
+    return (_catalog_version(), req.key(), req.top_k, numbers)
+
+
+def _semantic_lookup(question: str, req: ChatRequest):
+    # The embedding goes into the query cache, so retrieval on a miss reuses it.
+    embedding = _encode_query(question)
+    signature = _semantic_signature(question, req)
+    response, score = _semantic_cache.lookup(embedding, signature)
+    return response, score, embedding, signature
+
+
+def _retrieve_products(question: str, top_k: int, filters: SearchFilters | None = None):
+    top_k = min(max(top_k, 1), _index.ntotal)
+    allowed = _filter_mask(filters)
+    if allowed is None:
+        _, pairs = _search_coalescer.search(question, top_k)
+    else:
+        pairs = _search_vectors(_encode_query(question), top_k, allowed)[0]
+    return _hybrid_rank_products(question, pairs, allowed=allowed)
+
+
+@app.post("/ai/chat")
+async def chat(req: ChatRequest) -> dict:
+    question = req.question.strip()
+    if not question:
+        return {"answer": "Ask me about products or pricing.", "products": []}
+
+    if AI_CHAT_MODE == "general":
+        answer = ""
+        llm_used = "none"
+        llm_error = ""
+        try:
+            prompt = _build_general_prompt(question)
+            answer, llm_used = await _call_llm(prompt, system=_build_general_system_prompt(), versioned=False)
+        except (httpx.HTTPError, ValueError) as exc:
+            llm_error = str(exc)
+            answer = ""
+
+        if not answer:
+            answer = "Assistant is unavailable."
+
+        response = {"answer": answer, "products": []}
+        if AI_DEBUG:
+            response["llm_used"] = llm_used
+            response["llm_error"] = llm_error
+            response["llm_model"] = _get_active_llm_model(llm_used)
+            response.update(_debug_timings())
+        return response
+
+    if _index is None or _model is None or _collection is None:
+        raise HTTPException(status_code=503, detail="AI service not ready.")
+
+    # Retrieval is CPU- and Mongo-bound, so keep it off the event loop.
+    intent_response = await run_in_threadpool(_answer_from_intents, question, req)
+    if intent_response is not None:
+        if AI_DEBUG:
+            intent_response.update(_debug_timings())
+        return intent_response
+
+    with _stage("semantic_cache"):
+        cached, similarity, embedding, signature = await run_in_threadpool(_semantic_lookup, question, req)
+    if cached is not None:
+        response = dict(cached)
+        if AI_DEBUG:
+            response["semantic_cache"] = {"similarity": similarity, "threshold": _semantic_cache.threshold}
+            response.update(_debug_timings())
+        return response
 
-    product_ids = [item["id"] for item in pairs]
-    semantic_products = _load_products(product_ids)
-    products, score_map, source_map = _hybrid_rank_products(question, pairs, semantic_products)
+    with _stage("retrieve"):
+        products, score_map, retrieval = await run_in_threadpool(_retrieve_products, question, req.top_k, req)
     scores_for_products = [score_map.get(str(p.get("_id")), 0.0) for p in products]
 
     answer = ""
@@ -1038,54 +3157,90 @@ def chat(req: ChatRequest) -> dict:
     if AI_CHAT_MODE != "catalog":
         try:
             prompt = _build_chat_prompt(question, products[:6])
-            if _openai_available():
-                answer = _call_openai(prompt)
-                llm_used = "openai"
-            elif _gemini_available():
-                answer = _call_gemini(prompt)
-                llm_used = "gemini"
-            elif _ollama_available():
-                answer = _call_ollama(prompt)
-                llm_used = "ollama"
-        except requests.RequestException as exc:
+            answer, llm_used = await _call_llm(prompt, cacheable=_grounding_check(products))
+        except (httpx.HTTPError, ValueError) as exc:
             llm_error = str(exc)
             answer = ""
 
-    if (
-        AI_CHAT_MODE == "catalog"
-        or not answer
-        or _looks_like_refusal(answer)
-        or ((llm_used != "openai" and llm_used != "gemini") and _looks_generic(answer))
-        or ((llm_used != "openai" and llm_used != "gemini") and not _mentions_product(answer, products))
-    ):
-        # Fallback stays grounded and richer than generic "closest match" text.
-        if products:
-            answer = _build_product_list_answer(products[:6]) if _wants_product_list(question) else _build_answer(question, products, scores_for_products)
-        else:
-            answer = _build_answer(question, products, scores_for_products)
-    elif _wants_product_list(question) or len(answer.strip()) < 40:
-        answer = _build_product_list_answer(products)
-
+    answer = _finalize_chat_answer(question, answer, llm_used, products, scores_for_products)
     response = {
         "answer": answer,
-        "products": [
-            {
-                "id": str(p.get("_id")),
-                "name": p.get("name"),
-                "price": p.get("price"),
-                "category": p.get("category"),
-                "image": p.get("image"),
-            }
-            for p in products
-        ],
+        "products": [_product_summary(p) for p in products],
     }
+    if llm_used != "none" or AI_CHAT_MODE == "catalog":
+        # Fallbacks from an unavailable LLM are not worth replaying once it recovers.
+        _semantic_cache.store(embedding, signature, dict(response))
     if AI_DEBUG:
-        response["llm_used"] = llm_used
-        response["llm_error"] = llm_error
-        response["llm_model"] = _get_active_llm_model(llm_used)
-        response["retrieved_names"] = [p.get("name") for p in products[:8]]
-        response["retrieval_sources"] = {
-            str(p.get("_id")): source_map.get(str(p.get("_id")), "semantic")
-            for p in products[:8]
-        }
+        response.update(_chat_debug(llm_used, llm_error, products, retrieval))
     return response
+
+
+def _frame(payload: dict) -> bytes:
+    return (json.dumps(payload) + "\n").encode("utf-8")
+
+
+async def _stream_chat_frames(question: str, products, score_map, retrieval, prompt: str, system: str | None):
+    yield _frame({"type": "products", "products": [_product_summary(p) for p in products]})
+
+    answer = ""
+    llm_used = "none"
+    llm_error = ""
+    if AI_CHAT_MODE != "catalog":
+        try:
+            cacheable = _grounding_check(products) if AI_CHAT_MODE != "general" else None
+            tokens, llm_used = await _pick_llm_stream(
+                prompt, system=system, versioned=AI_CHAT_MODE != "general", cacheable=cacheable
+            )
+            if tokens is not None:
+                async for text in tokens:
+                    answer += text
+                    yield _frame({"type": "token", "text": text})
+        except (httpx.HTTPError, ValueError) as exc:
+            llm_error = str(exc)
+
+    streamed = answer
+    if AI_CHAT_MODE == "general":
+        answer = answer.strip() or "Assistant is unavailable."
+    else:
+        scores_for_products = [score_map.get(str(p.get("_id")), 0.0) for p in products]
+        answer = _finalize_chat_answer(question, answer.strip(), llm_used, products, scores_for_products)
+
+    # Clients render tokens as they arrive and swap in the final answer when it differs.
+    final = {"type": "final", "answer": answer, "fallback": answer != streamed.strip()}
+    if AI_DEBUG:
+        final.update(_chat_debug(llm_used, llm_error, products, retrieval))
+    yield _frame(final)
+
+
+@app.post("/ai/chat/stream")
+async def chat_stream(req: ChatRequest) -> StreamingResponse:
+    question = req.question.strip()
+    media_type = "application/x-ndjson"
+    if not question:
+        frames = [
+            _frame({"type": "products", "products": []}),
+            _frame({"type": "final", "answer": "Ask me about products or pricing.", "fallback": True}),
+        ]
+        return StreamingResponse(iter(frames), media_type=media_type)
+
+    if AI_CHAT_MODE == "general":
+        prompt = _build_general_prompt(question)
+        stream = _stream_chat_frames(question, [], {}, {}, prompt, _build_general_system_prompt())
+        return StreamingResponse(stream, media_type=media_type)
+
+    if _index is None or _model is None or _collection is None:
+        raise HTTPException(status_code=503, detail="AI service not ready.")
+
+    intent_response = await run_in_threadpool(_answer_from_intents, question, req)
+    if intent_response is not None:
+        final = {key: value for key, value in intent_response.items() if key != "products"}
+        frames = [
+            _frame({"type": "products", "products": intent_response["products"]}),
+            _frame({"type": "final", **final, "fallback": True}),
+        ]
+        return StreamingResponse(iter(frames), media_type=media_type)
+
+    products, score_map, retrieval = await run_in_threadpool(_retrieve_products, question, req.top_k, req)
+    prompt = _build_chat_prompt(question, products[:6])
+    stream = _stream_chat_frames(question, products, score_map, retrieval, prompt, None)
+    return StreamingResponse(stream, media_type=media_type)
@@ -0,0 +1,466 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List
+
+import numpy as np
+
+# The offline suite (python benchmark.py --offline) builds throwaway indexes and
+# talks to a stub LLM, so its settings must be in place before app and
+# build_index read the environment.
+OFFLINE = "--offline" in sys.argv
+BENCH_DIR = os.getenv("AI_BENCH_DIR", "data/bench")
+BENCH_LLM_LATENCY_MS = float(os.getenv("AI_BENCH_LLM_LATENCY_MS", "200"))
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """Answers the Ollama endpoints the service uses after a fixed delay."""
+
+    answer = "Here are a few good matches from the catalog. Want me to narrow it down?"
+
+    def _send(self, payload: dict) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        self._send({"models": [{"name": os.environ.get("AI_OLLAMA_MODEL", "phi3:mini")}]})
+
+    def do_POST(self) -> None:
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        time.sleep(BENCH_LLM_LATENCY_MS / 1000)
+        done = {"done": True, "load_duration": 0, "total_duration": int(BENCH_LLM_LATENCY_MS * 1e6)}
+        if not request.get("stream"):
+            self._send({"response": self.answer, **done})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for word in self.answer.split(" "):
+            self.wfile.write((json.dumps({"response": word + " ", "done": False}) + "\n").encode("utf-8"))
+        self.wfile.write((json.dumps({"response": "", **done}) + "\n").encode("utf-8"))
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def start_stub_llm() -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubLLMHandler)
+    threading.Thread(target=server.serve_forever, name="stub-llm", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if OFFLINE:
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    os.environ.update(
+        {
+            "AI_INDEX_PATH": os.path.join(BENCH_DIR, "faiss.index"),
+            "AI_META_PATH": os.path.join(BENCH_DIR, "meta.json"),
+            "AI_IDS_PATH": os.path.join(BENCH_DIR, "ids.npy"),
+            "AI_TEXT_INDEX_PATH": os.path.join(BENCH_DIR, "text_index.pkl"),
+            "AI_INDEX_SYNC_INTERVAL": "0",
+            "AI_LLM_PROVIDER": "ollama",
+            "AI_OLLAMA_URL": start_stub_llm(),
+            # Measure the pipeline, not the caches in front of it.
+            "AI_LLM_CACHE_SIZE": "0",
+            "AI_SEMANTIC_CACHE_SIZE": "0",
+            "AI_SLOW_REQUEST_MS": "0",
+        }
+    )
+
+import app  # noqa: E402
+from build_index import (  # noqa: E402
+    AI_INDEX_BATCH_SIZE,
+    IDS_PATH,
+    INDEX_PATH,
+    TEXT_FIELDS,
+    build_full,
+    build_text,
+    encode_texts,
+    index_spec,
+    load_model,
+)
+
+BENCH_QUERIES = int(os.getenv("AI_BENCH_QUERIES", "256"))
+BENCH_BATCH_SIZE = int(os.getenv("AI_BENCH_BATCH_SIZE", "32"))
+BENCH_TOP_K = int(os.getenv("AI_BENCH_TOP_K", "12"))
+BENCH_CONCURRENCY = int(os.getenv("AI_BENCH_CONCURRENCY", "16"))
+BENCH_EMBED_BACKENDS = [b.strip() for b in os.getenv("AI_BENCH_EMBED_BACKENDS", "").split(",") if b.strip()]
+BENCH_EMBED_DOCS = int(os.getenv("AI_BENCH_EMBED_DOCS", "2000"))
+BENCH_PARITY_MIN = float(os.getenv("AI_BENCH_PARITY_MIN", "0.99"))
+BENCH_CATALOG_SIZES = [int(n) for n in os.getenv("AI_BENCH_CATALOG_SIZES", "1000,10000").split(",") if n.strip()]
+BENCH_MONGO_URI = os.getenv("AI_BENCH_MONGO_URI", "")
+BENCH_MONGO_DB = os.getenv("AI_BENCH_MONGO_DB", "ai_bench")
+BENCH_REPORT = os.getenv("AI_BENCH_REPORT", os.path.join(BENCH_DIR, "report.json"))
+BENCH_BASELINE = os.getenv("AI_BENCH_BASELINE", "")
+BENCH_TOLERANCE = float(os.getenv("AI_BENCH_TOLERANCE", "0.2"))
+
+INTENT_QUESTIONS = [
+    "show me all products from my database", "what is the most expensive item", "cheapest product please",
+    "give me the product list with prices", "details of the smart watch", "hi", "thanks",
+    "what can you do", "difference between these two", "something cheaper", "gift for my dad",
+    "do you sell laptops", "wireless headphones under $50 with good battery life and noise cancelling",
+]
+
+QUERY_WORDS = [
+    "wireless", "headphones", "gift", "under", "$50", "black", "leather", "wallet", "running",
+    "shoes", "smart", "watch", "cotton", "t-shirt", "travel", "backpack", "hoodie", "jacket",
+    "sunglasses", "speaker", "webcam", "usb", "cable", "cap", "jeans", "cheap", "premium",
+]
+
+
+def make_queries(count: int, seed: int = 7) -> List[str]:
+    rng = random.Random(seed)
+    return [" ".join(rng.sample(QUERY_WORDS, rng.randint(1, 4))) for _ in range(count)]
+
+
+def _timed(label: str, count: int, run: Callable[[], None]) -> float:
+    # Start every run with a cold embedding cache so the encoder cost is measured.
+    app._embed_cache.clear()
+    started = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - started
+    qps = count / elapsed if elapsed > 0 else 0.0
+    print(f"{label:<24} {count:>6} queries  {elapsed * 1000:>9.1f} ms  {qps:>9.1f} q/s")
+    return qps
+
+
+def bench_batch_search(queries: List[str]) -> None:
+    def single() -> None:
+        for query in queries:
+            app.search(app.SearchRequest(query=query, top_k=BENCH_TOP_K))
+
+    def batched() -> None:
+        for start in range(0, len(queries), BENCH_BATCH_SIZE):
+            chunk = queries[start:start + BENCH_BATCH_SIZE]
+            app.search_batch(app.BatchSearchRequest(queries=chunk, top_k=BENCH_TOP_K))
+
+    single_qps = _timed("/ai/search", len(queries), single)
+    batch_qps = _timed(f"/ai/search/batch x{BENCH_BATCH_SIZE}", len(queries), batched)
+    if single_qps:
+        print(f"batch speedup: {batch_qps / single_qps:.2f}x")
+
+
+def bench_concurrent_search(queries: List[str]) -> None:
+    def concurrent() -> None:
+        with ThreadPoolExecutor(BENCH_CONCURRENCY) as pool:
+            list(pool.map(lambda q: app.search(app.SearchRequest(query=q, top_k=BENCH_TOP_K)), queries))
+
+    coalescer = app._search_coalescer
+    enabled = coalescer.enabled
+    coalescer.enabled = False
+    _timed(f"concurrent x{BENCH_CONCURRENCY}", len(queries), concurrent)
+    coalescer.enabled = enabled
+    _timed(f"coalesced x{BENCH_CONCURRENCY}", len(queries), concurrent)
+
+
+def bench_embedding_backends(queries: List[str], backends: List[str]) -> None:
+    """Per-query latency, build throughput and parity with the torch reference.
+
+    Parity is the cosine between each backend's query vector and the reference
+    one, plus the overlap of their top-k hits on the loaded index.
+    """
+    docs = []
+    if app._collection is not None:
+        docs = list(app._collection.find({}, TEXT_FIELDS).limit(BENCH_EMBED_DOCS))
+    texts = [build_text(doc) for doc in docs] or queries
+    k = min(BENCH_TOP_K, app._index.ntotal)
+    reference_model = load_model("torch")
+    reference = encode_texts(reference_model, queries)
+    _, reference_hits = app._index.search(reference, k)
+
+    print(f"{'backend':<12} {'p50 ms':>8} {'p95 ms':>8} {'docs/s':>9} {'min cos':>8} {'mean cos':>9} {'overlap':>8}")
+    for backend in backends:
+        model = reference_model if backend == "torch" else load_model(backend)
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            encode_texts(model, [query])
+            latencies.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        for start in range(0, len(texts), AI_INDEX_BATCH_SIZE):
+            encode_texts(model, texts[start:start + AI_INDEX_BATCH_SIZE])
+        docs_per_s = len(texts) / (time.perf_counter() - started)
+
+        embeddings = encode_texts(model, queries)
+        cosine = np.sum(embeddings * reference, axis=1)
+        _, hits = app._index.search(embeddings, k)
+        overlap = np.mean([len(set(row) & set(ref)) / k for row, ref in zip(hits, reference_hits)])
+        p50, p95 = np.percentile(np.asarray(latencies) * 1000, [50, 95])
+        verdict = "" if cosine.min() >= BENCH_PARITY_MIN else f"  below parity {BENCH_PARITY_MIN}"
+        print(
+            f"{backend:<12} {p50:>8.2f} {p95:>8.2f} {docs_per_s:>9.1f} {cosine.min():>8.4f} "
+            f"{cosine.mean():>9.4f} {overlap:>8.3f}{verdict}"
+        )
+
+
+def legacy_intents(question: str) -> frozenset:
+    """The per-intent substring checks the chat path ran before IntentRouter, kept as a baseline."""
+    lowered = question.lower()
+    stripped = lowered.strip()
+    found = set()
+    for intent, triggers in app.INTENT_PHRASES.items():
+        if intent in ("cheap_word", "product_word"):
+            continue
+        if any(phrase in lowered for phrase in triggers):
+            found.add(intent)
+    if "cheap" in lowered and ("product" in lowered or "item" in lowered):
+        found.add("cheapest")
+    if stripped in app.INTENT_EXACT:
+        found.add(app.INTENT_EXACT[stripped])
+    return frozenset(found)
+
+
+def bench_intent_router(rounds: int = 2000) -> None:
+    router = app._intent_router
+    internal = {"cheap_word", "product_word"}
+    for question in INTENT_QUESTIONS:
+        routed = router.route(question) - internal
+        if routed != legacy_intents(question):
+            raise RuntimeError(f"Intent mismatch for {question!r}: {sorted(routed)} vs {sorted(legacy_intents(question))}")
+
+    for label, route in (("legacy intent chain", legacy_intents), ("intent router", router.route)):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for question in INTENT_QUESTIONS:
+                route(question)
+        elapsed = time.perf_counter() - started
+        per_call = elapsed / (rounds * len(INTENT_QUESTIONS)) * 1e6
+        print(f"{label:<24} {per_call:>9.2f} us/question")
+
+
+CATALOG = {
+    "Electronics": (["headphones", "speaker", "webcam", "usb cable", "smart watch", "charger", "keyboard"],
+                    ["wireless", "bluetooth", "noise cancelling", "fast charging", "long battery life"]),
+    "Clothing": (["t-shirt", "hoodie", "jacket", "jeans", "cap", "socks", "sweater"],
+                 ["cotton", "slim fit", "breathable", "water resistant", "relaxed fit"]),
+    "Accessories": (["wallet", "backpack", "sunglasses", "belt", "travel bag", "watch strap"],
+                    ["leather", "polarized", "anti-theft", "lightweight", "handmade"]),
+    "Shoes": (["running shoes", "sneakers", "boots", "sandals", "loafers"],
+              ["cushioned", "non-slip", "waterproof", "memory foam", "vegan"]),
+    "Home": (["desk lamp", "mug", "blanket", "plant pot", "storage box"],
+             ["ceramic", "dimmable", "eco-friendly", "stackable", "oversized"]),
+}
+COLORS = ["black", "white", "navy", "red", "green", "grey", "beige", "blue", "pink", "olive"]
+BRANDS = ["Nova", "Apex", "Urban", "Terra", "Luma", "Vertex", "Nimbus", "Orbit", "Aero", "Kite"]
+
+
+def make_catalog(count: int, seed: int = 11):
+    """Yield ``count`` synthetic products shaped like the real seed data."""
+    rng = random.Random(seed)
+    categories = list(CATALOG)
+    # Naive UTC, as pymongo returns it.
+    started = datetime(2026, 1, 1)
+    for pos in range(count):
+        category = rng.choice(categories)
+        nouns, features = CATALOG[category]
+        noun = rng.choice(nouns)
+        color = rng.choice(COLORS)
+        picked = rng.sample(features, 3)
+        name = f"{rng.choice(BRANDS)} {color} {noun} {rng.choice(['', 'Pro', 'Lite', 'Max', 'Mini', '2'])}".strip()
+        price = round(rng.lognormvariate(3.3, 0.8), 2)
+        stock = rng.choice([0, rng.randint(1, 200)])
+        yield {
+            "name": name,
+            "description": (
+                f"The {name} is a {picked[0]} {noun} in {color}, built for everyday use. "
+                f"It is {picked[1]} and {picked[2]}, and makes a great gift under ${int(price) + 10}."
+            ),
+            "highlights": [feature.capitalize() for feature in picked] + [f"Model {pos % 997:03d}"],
+            "category": category,
+            "price": price,
+            "originalPrice": round(price * 1.2, 2),
+            "stock": stock,
+            "inStock": stock > 0,
+            "rating": round(rng.uniform(3.0, 5.0), 1),
+            "reviewCount": rng.randint(0, 2000),
+            "sku": f"SKU-{pos:07d}",
+            "updatedAt": started + timedelta(seconds=pos),
+        }
+
+
+def stand_in_client():
+    if BENCH_MONGO_URI:
+        return app.MongoClient(BENCH_MONGO_URI)
+    try:
+        import mongomock
+    except ImportError as exc:
+        raise RuntimeError("Set AI_BENCH_MONGO_URI to a scratch Mongo or pip install mongomock.") from exc
+    return mongomock.MongoClient()
+
+
+def seed_catalog(collection, count: int, batch_size: int = 10000) -> None:
+    collection.delete_many({})
+    batch = []
+    for doc in make_catalog(count):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            collection.insert_many(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch)
+
+
+def _latency_report(latencies: List[float], count: int, elapsed: float) -> Dict[str, float]:
+    p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+    return {
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "qps": round(count / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+
+
+def _clear_caches() -> None:
+    # Each workload starts cold so one does not ride on the caches the previous one warmed.
+    app._embed_cache.clear()
+    app._product_cache.clear()
+    app._product_list_cache.clear()
+
+
+def bench_search_latency(queries: List[str]) -> Dict[str, float]:
+    _clear_caches()
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        app.search(app.SearchRequest(query=query, top_k=BENCH_TOP_K))
+        latencies.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(BENCH_CONCURRENCY) as pool:
+        list(pool.map(lambda q: app.search(app.SearchRequest(query=q, top_k=BENCH_TOP_K)), queries))
+    return _latency_report(latencies, len(queries), time.perf_counter() - started)
+
+
+def bench_chat_latency(queries: List[str], mode: str) -> Dict[str, float]:
+    app.AI_CHAT_MODE = mode
+    _clear_caches()
+
+    async def run() -> Dict[str, float]:
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            await app.chat(app.ChatRequest(question=query, top_k=6))
+            latencies.append(time.perf_counter() - started)
+        gate = asyncio.Semaphore(BENCH_CONCURRENCY)
+
+        async def one(query: str) -> None:
+            async with gate:
+                await app.chat(app.ChatRequest(question=query, top_k=6))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(query) for query in queries))
+        elapsed = time.perf_counter() - started
+        # The pooled client belongs to this event loop.
+        await app.close_llm_client()
+        return _latency_report(latencies, len(queries), elapsed)
+
+    return asyncio.run(run())
+
+
+def run_offline_size(client, count: int, queries: List[str]) -> dict:
+    collection = client[BENCH_MONGO_DB]["products"]
+    started = time.perf_counter()
+    seed_catalog(collection, count)
+    seed_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        build_full(collection)
+    build_s = time.perf_counter() - started
+
+    # load_assets connects through app.MongoClient; hand it the stand-in instead.
+    app.MongoClient = lambda *args, **kwargs: client
+    app.MONGO_URI = BENCH_MONGO_URI or "mongodb://stand-in"
+    app.MONGO_DB = BENCH_MONGO_DB
+    app._id_pos = None
+    started = time.perf_counter()
+    app.load_assets()
+    startup_s = time.perf_counter() - started
+
+    result = {
+        "docs": count,
+        "index": index_spec(),
+        "seed_s": round(seed_s, 2),
+        "build_s": round(build_s, 2),
+        "build_docs_per_s": round(count / build_s, 1) if build_s > 0 else 0.0,
+        "index_mb": round((os.path.getsize(INDEX_PATH) + os.path.getsize(IDS_PATH)) / 2**20, 2),
+        "startup_s": round(startup_s, 2),
+        "search": bench_search_latency(queries),
+        "chat_catalog": bench_chat_latency(queries, "catalog"),
+        "chat_stub_llm": bench_chat_latency(queries, "llm"),
+    }
+    print(
+        f"{count:>9} docs  build {result['build_s']:>8.2f} s ({result['build_docs_per_s']:>8.1f} docs/s)  "
+        f"index {result['index_mb']:>8.2f} MB  startup {result['startup_s']:>6.2f} s"
+    )
+    for workload in ("search", "chat_catalog", "chat_stub_llm"):
+        stats = result[workload]
+        print(
+            f"{'':>11}{workload:<14} p50 {stats['p50_ms']:>8.2f}  p95 {stats['p95_ms']:>8.2f}  "
+            f"p99 {stats['p99_ms']:>8.2f} ms  {stats['qps']:>8.1f} q/s"
+        )
+    return result
+
+
+def compare_baseline(results: List[dict], baseline_path: str) -> List[str]:
+    """Return the p99 latencies that grew by more than BENCH_TOLERANCE against the baseline report."""
+    with open(baseline_path, encoding="utf-8") as handle:
+        baseline = {row["docs"]: row for row in json.load(handle)["results"]}
+    regressions = []
+    for row in results:
+        previous = baseline.get(row["docs"])
+        if previous is None:
+            continue
+        for workload in ("search", "chat_catalog", "chat_stub_llm"):
+            before = previous.get(workload, {}).get("p99_ms")
+            after = row[workload]["p99_ms"]
+            if before and after > before * (1 + BENCH_TOLERANCE):
+                regressions.append(f"{row['docs']} docs {workload}: p99 {before:.2f} -> {after:.2f} ms")
+    return regressions
+
+
+def offline_main() -> None:
+    client = stand_in_client()
+    queries = make_queries(BENCH_QUERIES)
+    print(f"Offline suite: sizes {BENCH_CATALOG_SIZES}, stub LLM latency {BENCH_LLM_LATENCY_MS:g} ms")
+    results = [run_offline_size(client, count, queries) for count in BENCH_CATALOG_SIZES]
+    with open(BENCH_REPORT, "w", encoding="utf-8") as handle:
+        json.dump({"created": datetime.now(timezone.utc).isoformat(), "results": results}, handle, indent=2)
+    print(f"Report written to {BENCH_REPORT}")
+    if BENCH_BASELINE:
+        regressions = compare_baseline(results, BENCH_BASELINE)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            raise SystemExit(1)
+
+
+def main() -> None:
+    app.load_assets()
+    if app._index is None:
+        raise RuntimeError("Index not found. Run build_index.py first.")
+    queries = make_queries(BENCH_QUERIES)
+    bench_batch_search(queries)
+    bench_concurrent_search(queries)
+    bench_intent_router()
+    if BENCH_EMBED_BACKENDS:
+        bench_embedding_backends(queries, BENCH_EMBED_BACKENDS)
+
+
+if __name__ == "__main__":
+    if OFFLINE:
+        offline_main()
+    else:
+        main()
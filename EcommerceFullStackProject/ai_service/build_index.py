@@ -1,17 +1,48 @@
+import heapq
 import json
+import math
 import os
-from typing import List
+import pickle
+import re
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
 
 import faiss
 import numpy as np
+from bson import ObjectId
 from pymongo import MongoClient
 from sentence_transformers import SentenceTransformer
 
 MONGO_URI = os.getenv("MONGO_URI")
 MONGO_DB = os.getenv("MONGO_DB")
 MODEL_NAME = os.getenv("AI_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
+AI_EMBED_BACKEND = os.getenv("AI_EMBED_BACKEND", "torch").lower()
+AI_EMBED_ONNX_FILE = os.getenv("AI_EMBED_ONNX_FILE", "")
 INDEX_PATH = os.getenv("AI_INDEX_PATH", "data/faiss.index")
 META_PATH = os.getenv("AI_META_PATH", "data/meta.json")
+IDS_PATH = os.getenv("AI_IDS_PATH", "data/ids.npy")
+TEXT_INDEX_PATH = os.getenv("AI_TEXT_INDEX_PATH", "data/text_index.pkl")
+AI_INDEX_REBUILD = os.getenv("AI_INDEX_REBUILD", "0") == "1"
+AI_INDEX_BATCH_SIZE = int(os.getenv("AI_INDEX_BATCH_SIZE", "512"))
+AI_INDEX_TYPE = os.getenv("AI_INDEX_TYPE", "flat").lower()
+AI_INDEX_NLIST = int(os.getenv("AI_INDEX_NLIST", "1024"))
+AI_INDEX_NPROBE = int(os.getenv("AI_INDEX_NPROBE", "16"))
+AI_INDEX_HNSW_M = int(os.getenv("AI_INDEX_HNSW_M", "32"))
+AI_INDEX_EF_CONSTRUCTION = int(os.getenv("AI_INDEX_EF_CONSTRUCTION", "80"))
+AI_INDEX_EF_SEARCH = int(os.getenv("AI_INDEX_EF_SEARCH", "64"))
+AI_INDEX_MAX_TOMBSTONES = float(os.getenv("AI_INDEX_MAX_TOMBSTONES", "0.25"))
+AI_INDEX_REPORT = os.getenv("AI_INDEX_REPORT", "0") == "1"
+AI_INDEX_REPORT_QUERIES = int(os.getenv("AI_INDEX_REPORT_QUERIES", "200"))
+AI_INDEX_REPORT_K = int(os.getenv("AI_INDEX_REPORT_K", "10"))
+
+# ObjectId hex strings are 24 ASCII chars; tombstoned labels are stored as b"".
+ID_DTYPE = "S24"
+EMBED_FIELDS = ("name", "description", "category", "highlights")
+TEXT_FIELDS = {**{field: 1 for field in EMBED_FIELDS}, "updatedAt": 1}
+# Attributes the service filters on; fetched with synced documents so its filter columns stay current.
+FILTER_FIELDS = ("price", "category", "stock", "inStock")
+SYNC_FIELDS = {**TEXT_FIELDS, **{field: 1 for field in FILTER_FIELDS}}
 
 
 def build_text(doc: dict) -> str:
@@ -28,7 +59,515 @@ def build_text(doc: dict) -> str:
     return " ".join(parts).strip()
 
 
-def main() -> None:
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN_RE.findall(text.lower()) if len(token) >= 2]
+
+
+class BM25Index:
+    """In-memory inverted index with Okapi BM25 scoring, keyed by product id.
+
+    Documents are tokenized from ``build_text`` so lexical and semantic
+    retrieval see the same fields. ``add`` replaces an existing document.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_terms = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_terms)
+
+    def add(self, pid: str, text: str) -> None:
+        self.remove(pid)
+        terms = {}
+        for token in tokenize(text):
+            terms[token] = terms.get(token, 0) + 1
+        if not terms:
+            return
+        length = sum(terms.values())
+        self.doc_terms[pid] = (length, terms)
+        self.total_length += length
+        for token, tf in terms.items():
+            self.postings.setdefault(token, {})[pid] = tf
+
+    def remove(self, pid: str) -> None:
+        entry = self.doc_terms.pop(pid, None)
+        if entry is None:
+            return
+        length, terms = entry
+        self.total_length -= length
+        for token in terms:
+            posting = self.postings[token]
+            del posting[pid]
+            if not posting:
+                del self.postings[token]
+
+    def search(self, query: str, limit: int = 10, accept=None):
+        count = len(self.doc_terms)
+        if not count:
+            return []
+        avg_length = self.total_length / count
+        scores = {}
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if not posting:
+                continue
+            idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+            for pid, tf in posting.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_terms[pid][0] / avg_length)
+                scores[pid] = scores.get(pid, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        if accept is not None:
+            scores = {pid: score for pid, score in scores.items() if accept(pid)}
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def state(self) -> dict:
+        # Plain containers only, so the saved file does not depend on where this class was imported from.
+        return {
+            "k1": self.k1,
+            "b": self.b,
+            "postings": self.postings,
+            "doc_terms": self.doc_terms,
+            "total_length": self.total_length,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "BM25Index":
+        index = cls(state["k1"], state["b"])
+        index.postings = state["postings"]
+        index.doc_terms = state["doc_terms"]
+        index.total_length = state["total_length"]
+        return index
+
+
+def add_text(keyword_index: BM25Index, names: Dict[str, Optional[str]], docs: Iterable[dict]) -> None:
+    for doc in docs:
+        pid = str(doc["_id"])
+        names[pid] = doc.get("name")
+        keyword_index.add(pid, build_text(doc))
+
+
+EMBED_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8", "openvino")
+# Pre-exported dynamic int8 model shipped in the sentence-transformers hub repos (AVX2 baseline).
+ONNX_INT8_FILE = "onnx/model_quint8_avx2.onnx"
+
+
+def embedding_spec(backend: str = AI_EMBED_BACKEND) -> str:
+    # Stored as meta["model"]; plain torch keeps the bare name so older indexes still match.
+    return MODEL_NAME if backend == "torch" else f"{MODEL_NAME}@{backend}"
+
+
+def load_model(backend: str = AI_EMBED_BACKEND):
+    """Load the embedding model on the requested CPU backend.
+
+    ``onnx``/``openvino`` need ``pip install "sentence-transformers[onnx]"``
+    (or ``[openvino]``). ``torch-int8`` applies PyTorch dynamic quantization to
+    the Linear layers; ``onnx-int8`` loads the pre-quantized ONNX export unless
+    ``AI_EMBED_ONNX_FILE`` points elsewhere.
+    """
+    if backend not in EMBED_BACKENDS:
+        raise RuntimeError(f"Unknown AI_EMBED_BACKEND {backend!r}; expected one of {', '.join(EMBED_BACKENDS)}.")
+    if backend.startswith("torch"):
+        model = SentenceTransformer(MODEL_NAME)
+        if backend == "torch-int8":
+            import torch
+
+            torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        return model
+    model_file = AI_EMBED_ONNX_FILE or (ONNX_INT8_FILE if backend == "onnx-int8" else "")
+    model_kwargs = {"file_name": model_file} if model_file else None
+    return SentenceTransformer(MODEL_NAME, backend=backend.split("-")[0], model_kwargs=model_kwargs)
+
+
+def iter_batches(docs: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    batch: List[dict] = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def encode_texts(model, texts: List[str]) -> np.ndarray:
+    embeddings = model.encode(texts, normalize_embeddings=True)
+    return np.asarray(embeddings, dtype="float32")
+
+
+def index_spec(index_type: str = AI_INDEX_TYPE) -> str:
+    if index_type == "ivf":
+        return f"ivf{AI_INDEX_NLIST}"
+    if index_type == "hnsw":
+        return f"hnsw{AI_INDEX_HNSW_M}"
+    if index_type == "flat":
+        return "flat"
+    raise RuntimeError(f"Unknown AI_INDEX_TYPE {index_type!r}; expected flat, ivf or hnsw.")
+
+
+def new_index(dim: int, expected_count: int = 0, index_type: str = AI_INDEX_TYPE):
+    # Labels are positions in the id map, so a product keeps its label across
+    # upserts and deletes only leave a tombstone behind.
+    index_spec(index_type)
+    if index_type == "ivf":
+        # IVF stores explicit ids and supports removal itself, so it is not wrapped.
+        nlist = AI_INDEX_NLIST
+        if expected_count:
+            nlist = max(1, min(nlist, expected_count // 39))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, AI_INDEX_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = AI_INDEX_EF_CONSTRUCTION
+        index = faiss.IndexIDMap2(hnsw)
+    else:
+        index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+    set_search_params(index)
+    return index
+
+
+def _inner_index(index):
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def set_search_params(index, nprobe: int = AI_INDEX_NPROBE, ef_search: int = AI_INDEX_EF_SEARCH) -> None:
+    inner = _inner_index(index)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = nprobe
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = ef_search
+
+
+def search_parameters(
+    index, selector, nprobe: int = AI_INDEX_NPROBE, ef_search: int = AI_INDEX_EF_SEARCH, widen: float = 1.0
+):
+    """Search parameters restricted to ``selector``.
+
+    Per-call parameters replace the index defaults, so nprobe/efSearch are
+    carried along, scaled by ``widen`` (total / selected) so that a selective
+    filter still reaches enough matching vectors in approximate indexes.
+    """
+    inner = _inner_index(index)
+    if isinstance(inner, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=min(inner.nlist, int(np.ceil(nprobe * widen))))
+    if isinstance(inner, faiss.IndexHNSW):
+        ef_limit = max(index.ntotal, ef_search)
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=min(ef_limit, int(np.ceil(ef_search * widen))))
+    return faiss.SearchParameters(sel=selector)
+
+
+def train_size(index) -> int:
+    inner = _inner_index(index)
+    if isinstance(inner, faiss.IndexIVF):
+        return inner.nlist * 64
+    return 0
+
+
+def supports_updates(index) -> bool:
+    return isinstance(index, (faiss.IndexIDMap2, faiss.IndexIVF))
+
+
+def supports_removal(index) -> bool:
+    # HNSW graphs cannot drop vectors; stale ones stay behind as tombstoned labels.
+    return not isinstance(_inner_index(index), faiss.IndexHNSW)
+
+
+class IdMap:
+    """Label -> product id lookup over a fixed-width id array.
+
+    The array may be a read-only memory map shared between workers; writes go
+    to an overlay so the live map can still be patched in place.
+    """
+
+    def __init__(self, base: Optional[np.ndarray] = None) -> None:
+        self.base = base if base is not None else np.empty(0, dtype=ID_DTYPE)
+        self.overlay: Dict[int, Optional[str]] = {}
+        self.extra: List[Optional[str]] = []
+
+    def __len__(self) -> int:
+        return len(self.base) + len(self.extra)
+
+    def __getitem__(self, label) -> Optional[str]:
+        label = int(label)
+        if label in self.overlay:
+            return self.overlay[label]
+        if label < len(self.base):
+            value = self.base[label]
+            return value.decode("ascii") if value else None
+        return self.extra[label - len(self.base)]
+
+    def __setitem__(self, label, pid: Optional[str]) -> None:
+        label = int(label)
+        if label < len(self.base):
+            self.overlay[label] = pid
+        else:
+            self.extra[label - len(self.base)] = pid
+
+    def __iter__(self) -> Iterator[Optional[str]]:
+        for label in range(len(self)):
+            yield self[label]
+
+    def append(self, pid: Optional[str]) -> None:
+        self.extra.append(pid)
+
+    def live_count(self) -> int:
+        live = int(np.count_nonzero(self.base != b""))
+        for label, pid in self.overlay.items():
+            live += bool(pid) - bool(self.base[label])
+        return live + sum(1 for pid in self.extra if pid)
+
+    def to_array(self) -> np.ndarray:
+        array = np.empty(len(self), dtype=ID_DTYPE)
+        array[: len(self.base)] = self.base
+        for label, pid in self.overlay.items():
+            array[label] = (pid or "").encode("ascii")
+        array[len(self.base):] = [(pid or "").encode("ascii") for pid in self.extra]
+        return array
+
+
+def _tmp_path(path: str) -> str:
+    # Per-process temp names, so two writers never interleave in one temp file.
+    return f"{path}.{os.getpid()}.tmp"
+
+
+def save_ids(ids: np.ndarray, path: str = IDS_PATH) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, "wb") as handle:
+        np.save(handle, np.asarray(ids, dtype=ID_DTYPE))
+    os.replace(tmp_path, path)
+
+
+def load_id_map(meta: dict, path: str = IDS_PATH, mmap: bool = False) -> IdMap:
+    if "ids" in meta:
+        # Legacy meta.json kept the ids inline as a JSON list.
+        return IdMap(np.asarray([(pid or "").encode("ascii") for pid in meta["ids"]], dtype=ID_DTYPE))
+    return IdMap(np.load(path, mmap_mode="r" if mmap else None))
+
+
+def load_meta(path: str = META_PATH) -> dict:
+    with open(path, "r", encoding="utf-8") as handle:
+        data = json.load(handle)
+    if isinstance(data, list):
+        # Legacy meta.json was a bare list of product ids.
+        return {"ids": data, "watermark": None, "model": None}
+    return data
+
+
+def save_meta(meta: dict, path: str = META_PATH) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump(meta, handle)
+    os.replace(tmp_path, path)
+
+
+def save_index(index, path: str = INDEX_PATH) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = _tmp_path(path)
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def dump_text_index(keyword_index: BM25Index, names: Dict[str, Optional[str]], watermark: Optional[str]) -> bytes:
+    data = {"watermark": watermark, "keyword_index": keyword_index.state(), "names": names}
+    return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def save_text_index(data: bytes, path: str = TEXT_INDEX_PATH) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, "wb") as handle:
+        handle.write(data)
+    os.replace(tmp_path, path)
+
+
+def load_text_index(meta: dict, path: str = TEXT_INDEX_PATH):
+    """Return (keyword_index, names) saved alongside ``meta``, or None if missing or from another save."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as handle:
+            data = pickle.load(handle)
+        keyword_index = BM25Index.from_state(data["keyword_index"])
+        names = data["names"]
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, KeyError, TypeError) as exc:
+        print(f"Ignoring {path}: cannot be read ({exc or type(exc).__name__}).")
+        return None
+    if data.get("watermark") != meta.get("watermark"):
+        print(f"Ignoring {path}: saved at watermark {data.get('watermark')}, index is at {meta.get('watermark')}.")
+        return None
+    return keyword_index, names
+
+
+def save_all(index, ids: np.ndarray, meta: dict, text: Optional[bytes] = None, index_path: str = INDEX_PATH,
+             ids_path: str = IDS_PATH, meta_path: str = META_PATH, text_path: str = TEXT_INDEX_PATH,
+             renumbered: bool = False) -> None:
+    """Replace the index files in crash-safe order.
+
+    Ids go first: when patching, ids only grow and every label the new index
+    uses is in them, so a crash before the index is replaced still leaves every
+    label resolvable. A full rebuild (``renumbered``) assigns new labels, so it
+    removes meta first; until the new meta lands, the files are not loaded and
+    the next build starts over.
+    The keyword index (from ``dump_text_index``) follows the vector index.
+    Meta goes last, recording ``ntotal`` and ``labels`` so a reader can tell
+    whether the files come from the same save (see ``files_consistent``).
+    """
+    if renumbered and os.path.exists(meta_path):
+        os.remove(meta_path)
+    save_ids(ids, ids_path)
+    save_index(index, index_path)
+    if text is not None:
+        save_text_index(text, text_path)
+    save_meta({**meta, "ntotal": int(index.ntotal), "labels": len(ids)}, meta_path)
+
+
+def files_consistent(meta: dict, index, id_map) -> bool:
+    if "ntotal" not in meta:
+        return True
+    return meta["ntotal"] == index.ntotal and meta.get("labels") == len(id_map)
+
+
+def format_watermark(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def parse_watermark(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def max_watermark(docs, since: Optional[datetime] = None) -> Optional[datetime]:
+    watermark = since
+    for doc in docs:
+        updated_at = doc.get("updatedAt")
+        if isinstance(updated_at, datetime) and (watermark is None or updated_at > watermark):
+            watermark = updated_at
+    return watermark
+
+
+def collect_changes(collection, id_pos: Dict[str, int], since: Optional[datetime], diff_ids: bool = True):
+    """Return (changed_docs, deleted_ids, watermark) relative to the current id map.
+
+    ``diff_ids`` also reads every ``_id`` to find deletes and documents written
+    without ``updatedAt``; that is a full collection scan, so frequent callers
+    should only ask for it occasionally.
+    """
+    query = {"updatedAt": {"$gt": since}} if since else {}
+    changed = list(collection.find(query, SYNC_FIELDS))
+    if not diff_ids:
+        return changed, [], max_watermark(changed, since)
+    changed_ids = {str(doc["_id"]) for doc in changed}
+
+    # Deletes never bump updatedAt, and documents written without timestamps
+    # would be missed by the watermark, so diff the live ids as well.
+    live_ids = {str(doc["_id"]) for doc in collection.find({}, {"_id": 1})}
+    indexed_ids = set(id_pos)
+    deleted_ids = sorted(indexed_ids - live_ids)
+    missing_ids = live_ids - indexed_ids - changed_ids
+    if missing_ids:
+        changed.extend(
+            collection.find({"_id": {"$in": [ObjectId(pid) for pid in missing_ids]}}, SYNC_FIELDS)
+        )
+
+    return changed, deleted_ids, max_watermark(changed, since)
+
+
+def apply_changes(index, id_map: List[Optional[str]], id_pos: Dict[str, int], ids, embeddings, deleted_ids) -> None:
+    """Patch a label-addressable index and its id map in place with upserts and deletes."""
+    removable = supports_removal(index)
+    if deleted_ids:
+        labels = [id_pos.pop(pid) for pid in deleted_ids if pid in id_pos]
+        if labels:
+            if removable:
+                index.remove_ids(np.asarray(labels, dtype="int64"))
+            for label in labels:
+                id_map[label] = None
+
+    if not ids:
+        return
+    labels = []
+    existing = []
+    for pid in ids:
+        label = id_pos.get(pid)
+        if label is not None and not removable:
+            id_map[label] = None
+            label = None
+        if label is None:
+            label = len(id_map)
+            id_map.append(pid)
+            id_pos[pid] = label
+        else:
+            existing.append(label)
+        labels.append(label)
+    if existing:
+        index.remove_ids(np.asarray(existing, dtype="int64"))
+    index.add_with_ids(embeddings, np.asarray(labels, dtype="int64"))
+
+
+def _percentile_ms(samples: List[float], pct: float) -> float:
+    return float(np.percentile(np.asarray(samples) * 1000, pct)) if samples else 0.0
+
+
+def report_index(index, reference, k: int = AI_INDEX_REPORT_K, query_count: int = AI_INDEX_REPORT_QUERIES) -> dict:
+    """Compare an approximate index with an exact flat index over the same vectors.
+
+    Queries are indexed vectors pushed off by random noise, so none of them is
+    its own nearest neighbour; reports recall@k and single-query p50/p99
+    latency for both indexes.
+    """
+    total = reference.ntotal
+    if total == 0:
+        return {}
+    k = min(k, total)
+    rng = np.random.default_rng(7)
+    positions = rng.choice(total, size=min(query_count, total), replace=False)
+    queries = np.vstack([reference.reconstruct(int(pos)) for pos in positions]).astype("float32")
+    noise = rng.standard_normal(queries.shape).astype("float32")
+    # Half the length of a unit embedding: a query near, not on, a product.
+    noise *= 0.5 / np.linalg.norm(noise, axis=1, keepdims=True)
+    queries += noise
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    def timed(target):
+        hits = []
+        latencies = []
+        for row in queries:
+            started = time.perf_counter()
+            _, labels = target.search(row.reshape(1, -1), k)
+            latencies.append(time.perf_counter() - started)
+            hits.append(labels[0])
+        return np.vstack(hits), latencies
+
+    exact, exact_latencies = timed(reference)
+    approx, approx_latencies = timed(index)
+    recall = np.mean([len(set(a[a >= 0]) & set(e[e >= 0])) / k for a, e in zip(approx, exact)])
+    report = {
+        "index": index_spec(),
+        "queries": len(queries),
+        f"recall@{k}": round(float(recall), 4),
+        "flat_p50_ms": round(_percentile_ms(exact_latencies, 50), 3),
+        "flat_p99_ms": round(_percentile_ms(exact_latencies, 99), 3),
+        "index_p50_ms": round(_percentile_ms(approx_latencies, 50), 3),
+        "index_p99_ms": round(_percentile_ms(approx_latencies, 99), 3),
+    }
+    print("Index report: " + ", ".join(f"{key}={value}" for key, value in report.items()))
+    return report
+
+
+def get_collection():
     if not MONGO_URI:
         raise RuntimeError("MONGO_URI is required to build the index.")
 
@@ -36,31 +575,145 @@ def main() -> None:
     db_name = MONGO_DB or client.get_database().name
     if not db_name:
         raise RuntimeError("MONGO_DB is required when MONGO_URI has no default database.")
-    collection = client[db_name]["products"]
+    return client[db_name]["products"]
+
+
+def build_full(collection, batch_size: int = AI_INDEX_BATCH_SIZE) -> None:
+    # Stream a projected cursor and encode batch by batch so peak memory is one
+    # batch of documents plus the vector and keyword indexes, not the whole catalog.
+    model = load_model()
+    total = collection.estimated_document_count()
+    cursor = collection.find({}, TEXT_FIELDS, batch_size=batch_size)
+
+    index = None
+    reference = None
+    ids: List[str] = []
+    keyword_index = BM25Index()
+    names: Dict[str, Optional[str]] = {}
+    untrained: List[np.ndarray] = []
+    added = 0
+    watermark = None
+    started = time.perf_counter()
+
+    def add(embeddings: np.ndarray) -> None:
+        nonlocal added
+        index.add_with_ids(embeddings, np.arange(added, added + len(embeddings), dtype="int64"))
+        added += len(embeddings)
+
+    for batch in iter_batches(cursor, batch_size):
+        embeddings = encode_texts(model, [build_text(doc) for doc in batch])
+        if index is None:
+            index = new_index(embeddings.shape[1], total)
+            if AI_INDEX_REPORT:
+                reference = faiss.IndexFlatIP(embeddings.shape[1])
+        if reference is not None:
+            reference.add(embeddings)
+        ids.extend(str(doc["_id"]) for doc in batch)
+        add_text(keyword_index, names, batch)
+        watermark = max_watermark(batch, watermark)
+
+        if index.is_trained:
+            add(embeddings)
+        else:
+            # IVF needs a training sample before anything can be added.
+            untrained.append(embeddings)
+            if sum(len(chunk) for chunk in untrained) >= train_size(index):
+                sample = np.vstack(untrained)
+                index.train(sample)
+                add(sample)
+                untrained = []
 
-    docs = list(collection.find({}))
-    if not docs:
+        elapsed = time.perf_counter() - started
+        rate = len(ids) / elapsed if elapsed > 0 else 0.0
+        print(f"Encoded {len(ids)}/{max(total, len(ids))} products ({rate:.0f} docs/s)", flush=True)
+
+    if index is None:
         raise RuntimeError("No products found. Seed products before indexing.")
 
-    texts = [build_text(doc) for doc in docs]
-    ids = [str(doc["_id"]) for doc in docs]
+    if untrained:
+        sample = np.vstack(untrained)
+        if len(sample) < _inner_index(index).nlist:
+            # The collection was smaller than its estimated count; size the lists to what we have.
+            index = new_index(sample.shape[1], len(sample))
+        index.train(sample)
+        add(sample)
+
+    if reference is not None:
+        report_index(index, reference)
+
+    save_all(
+        index,
+        np.asarray(ids, dtype=ID_DTYPE),
+        {"count": len(ids), "watermark": format_watermark(watermark), "model": embedding_spec(), "index": index_spec()},
+        dump_text_index(keyword_index, names, format_watermark(watermark)),
+        renumbered=True,
+    )
+    elapsed = time.perf_counter() - started
+    print(f"Indexed {len(ids)} products into {INDEX_PATH} ({index_spec()}) in {elapsed:.1f}s")
 
-    model = SentenceTransformer(MODEL_NAME)
-    embeddings = model.encode(texts, normalize_embeddings=True)
-    embeddings = np.asarray(embeddings, dtype="float32")
 
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatIP(dim)
-    index.add(embeddings)
+def build_incremental(collection) -> bool:
+    """Patch the on-disk index from the stored watermark. Returns False if a full build is needed."""
+    if AI_INDEX_REBUILD or not os.path.exists(INDEX_PATH) or not os.path.exists(META_PATH):
+        return False
+    meta = load_meta()
+    if "ids" not in meta and not os.path.exists(IDS_PATH):
+        return False
+    if meta.get("model") != embedding_spec() or meta.get("index", "flat") != index_spec():
+        return False
+    index = faiss.read_index(INDEX_PATH)
+    if not supports_updates(index):
+        return False
 
-    os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
-    faiss.write_index(index, INDEX_PATH)
+    id_map = load_id_map(meta)
+    if not files_consistent(meta, index, id_map):
+        print(f"{INDEX_PATH}, {IDS_PATH} and {META_PATH} come from different saves; rebuilding.")
+        return False
+    id_pos = {pid: pos for pos, pid in enumerate(id_map) if pid}
+    since = parse_watermark(meta.get("watermark"))
+    docs, deleted_ids, watermark = collect_changes(collection, id_pos, since)
+    if not supports_removal(index) and len(id_map):
+        # Every HNSW update or delete leaves a dead vector that searches over-fetch past.
+        dead = len(id_map) - len(id_pos) + len(deleted_ids) + sum(str(doc["_id"]) in id_pos for doc in docs)
+        if dead / (len(id_map) + len(docs)) > AI_INDEX_MAX_TOMBSTONES:
+            print(f"{dead} of {len(id_map) + len(docs)} labels would be tombstones; rebuilding.")
+            return False
+    text = load_text_index(meta)
+    if not docs and not deleted_ids and text is not None:
+        print(f"Index is up to date ({len(id_pos)} products).")
+        return True
+    if text is None:
+        # No keyword index from this save (or an older build); rebuild it from the text fields alone.
+        keyword_index, names = BM25Index(), {}
+        add_text(keyword_index, names, collection.find({}, TEXT_FIELDS))
+    else:
+        keyword_index, names = text
+        for pid in deleted_ids:
+            keyword_index.remove(pid)
+            names.pop(pid, None)
+        add_text(keyword_index, names, docs)
 
-    os.makedirs(os.path.dirname(META_PATH), exist_ok=True)
-    with open(META_PATH, "w", encoding="utf-8") as handle:
-        json.dump(ids, handle)
+    apply_changes(index, id_map, id_pos, [], None, deleted_ids)
+    model = load_model() if docs else None
+    for batch in iter_batches(docs, AI_INDEX_BATCH_SIZE):
+        ids = [str(doc["_id"]) for doc in batch]
+        embeddings = encode_texts(model, [build_text(doc) for doc in batch])
+        apply_changes(index, id_map, id_pos, ids, embeddings, [])
 
-    print(f"Indexed {len(ids)} products into {INDEX_PATH}")
+    save_all(
+        index,
+        id_map.to_array(),
+        {"count": len(id_pos), "watermark": format_watermark(watermark), "model": embedding_spec(), "index": index_spec()},
+        dump_text_index(keyword_index, names, format_watermark(watermark)),
+    )
+    print(f"Updated {len(docs)} and removed {len(deleted_ids)} products in {INDEX_PATH} ({len(id_pos)} total)")
+    return True
+
+
+def main() -> None:
+    collection = get_collection()
+    if not build_incremental(collection):
+        build_full(collection)
 
 
 if __name__ == "__main__":
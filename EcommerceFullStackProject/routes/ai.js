@@ -96,4 +96,55 @@ router.post('/ai/admin/generate', adminOnly, async (req, res) => {
   }
 })
 
+router.post('/ai/admin/generate/jobs', adminOnly, async (req, res) => {
+  try {
+    const response = await fetch(`${AI_SERVICE_URL}/ai/generate/jobs`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({
+        products: Array.isArray(req.body.products) ? req.body.products : [],
+        filter: req.body.filter || null,
+        limit: Number(req.body.limit) || 0,
+        apply: Boolean(req.body.apply),
+      }),
+    })
+
+    if (response.status === 400) {
+      return res.status(400).json({ error: 'No products to generate content for.' })
+    }
+    if (!response.ok) {
+      return res.status(502).json({ error: 'AI service unavailable.' })
+    }
+
+    const data = await response.json()
+    return res.json(data)
+  } catch (err) {
+    console.error('AI GENERATE JOB ERROR:', err.message)
+    return res.status(500).json({ error: 'Failed to start generation job.' })
+  }
+})
+
+router.get('/ai/admin/generate/jobs/:id', adminOnly, async (req, res) => {
+  try {
+    const id = encodeURIComponent(req.params.id)
+    const suffix = req.query.results
+      ? `/results?offset=${Number(req.query.offset) || 0}&limit=${Number(req.query.limit) || 100}`
+      : ''
+    const response = await fetch(`${AI_SERVICE_URL}/ai/generate/jobs/${id}${suffix}`)
+
+    if (response.status === 404) {
+      return res.status(404).json({ error: 'Unknown job.' })
+    }
+    if (!response.ok) {
+      return res.status(502).json({ error: 'AI service unavailable.' })
+    }
+
+    const data = await response.json()
+    return res.json(data)
+  } catch (err) {
+    console.error('AI GENERATE JOB ERROR:', err.message)
+    return res.status(500).json({ error: 'Failed to load generation job.' })
+  }
+})
+
 module.exports = router